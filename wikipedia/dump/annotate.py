@@ -1,13 +1,13 @@
 import os
 import sys
 import re
+import bisect
 import logging
 import argparse
 import multiprocessing
 
 import ujson as json
 
-from common import utils
 from common import wikiann
 
 
@@ -16,8 +16,15 @@ logging.basicConfig(format='%(asctime)s: %(levelname)s: %(message)s')
 logging.root.setLevel(level=logging.INFO)
 
 
-def process_one(line, verbose=True):
+def process_one(line, verbose=True, link_table=None):
+    """
+    :param link_table: link table of the block, if articles were parsed with
+      --link_table
+    """
     d = json.loads(line)
+    if link_table is not None:
+        d['links'] = [dict(link, **link_table[link.pop('ref')])
+                      for link in d['links']]
     result = {
         'id': d['id'],
         'title': d['title'],
@@ -32,27 +39,32 @@ def process_one(line, verbose=True):
 
     text = d['article']
     sentences = annotator.annotate(text, links=d['links'])
+    # Sentences are sorted and do not overlap, a link belongs to the last
+    # sentence starting before it, if it ends within the sentence
+    starts = [sent['start'] for sent in sentences]
     for sent in sentences:
-        matched_links = []
-        for link in d['links']:
-            if utils.is_in_range((link['start'], link['end']),
-                                 (sent['start'], sent['end'])):
-                link['start'] -= sent['start']
-                link['end'] -= sent['start']
-                '''
-                # tokenize link text
-                link['tokens'] = annotator.tokenize(link['text'], link['start'])
-                try:
-                    assert link['tokens'][0]['start'] == link['start']
-                    assert link['tokens'][-1]['end'] == link['end']
-                except AssertionError:
-                    if verbose:
-                        logger.warning(f"wicked link: ({link}, {d['title']})")
-                    continue
-                '''
-                matched_links.append(link)
-                count['matched_links'] += 1
-        sent['links'] = matched_links
+        sent['links'] = []
+    for link in d['links']:
+        i = bisect.bisect_right(starts, link['start']) - 1
+        if i >= 0 and link['end'] <= sentences[i]['end']:
+            sent = sentences[i]
+            # Offsets relative to the sentence, links of the article are
+            # left as is
+            link = dict(link, start=link['start'] - sent['start'],
+                        end=link['end'] - sent['start'])
+            '''
+            # tokenize link text
+            link['tokens'] = annotator.tokenize(link['text'], link['start'])
+            try:
+                assert link['tokens'][0]['start'] == link['start']
+                assert link['tokens'][-1]['end'] == link['end']
+            except AssertionError:
+                if verbose:
+                    logger.warning(f"wicked link: ({link}, {d['title']})")
+                continue
+            '''
+            sent['links'].append(link)
+            count['matched_links'] += 1
     result['sentences'] = sentences
 
     try:
@@ -71,17 +83,22 @@ def process_one(line, verbose=True):
     return result
 
 
-def process_block(inpath, outpath, verbose=True):
+def process_block(inpath, outpath, verbose=True, p_links=None):
+    link_table = None
+    if p_links:
+        with open(p_links, 'r') as f:
+            link_table = [json.loads(line) for line in f]
     with open(outpath, 'w') as fw, open(inpath, 'r') as f:
         for line in f:
-            result = process_one(line, verbose=verbose)
+            result = process_one(line, verbose=verbose,
+                                 link_table=link_table)
             if result['sentences']:
                 fw.write(json.dumps(result, sort_keys=True) + '\n')
 
 
-def process(inpath, outpath, verbose=True):
+def process(inpath, outpath, verbose=True, p_links=None):
     try:
-        process_block(inpath, outpath, verbose=verbose)
+        process_block(inpath, outpath, verbose=verbose, p_links=p_links)
     except Exception as e:
         logger.error('unexpected error')
         logger.error(inpath)
@@ -100,6 +117,9 @@ if __name__ == '__main__':
                         help='number of processors to use (default=1)')
     parser.add_argument('--verbose', '-v', default=False, action='store_true',
                         help='verbose logging')
+    parser.add_argument('--link_table', '-l', default=None,
+                        help='link table directory (links/), if blocks were '
+                        'parsed with --link_table')
     args = parser.parse_args()
 
     os.makedirs(args.outdir, exist_ok=True)
@@ -116,7 +136,9 @@ if __name__ == '__main__':
                     reverse=True):
         inpath = f'{args.indir}/{i}'
         outpath = f'{args.outdir}/{i}.ann'
-        pool.apply_async(process, args=(inpath, outpath, args.verbose,),)
+        p_links = f'{args.link_table}/{i}' if args.link_table else None
+        pool.apply_async(process,
+                         args=(inpath, outpath, args.verbose, p_links,),)
     pool.close()
     pool.join()
     logger.info('done.')
@@ -0,0 +1,224 @@
+"""Benchmark of the wikitext cleaning functions of common/extract.py.
+
+The bundled corpus (corpus/) has a very long page, a template-heavy and a
+table-heavy page, and pages in Chinese, Russian, Arabic and Hindi.
+
+Pages of a corpus (*.wiki) are cleaned the way
+parse_pages_articles_multistream.py cleans them, while the arguments of
+every call to the functions below are recorded. Each function is then
+replayed in isolation on its recorded calls: timed (best of --repeat) and
+traced with tracemalloc for the peak memory allocated by a call.
+
+A digest of the outputs of each function tells whether a change to the
+extractor changed any output. Results can be saved as a baseline with
+--save, and compared to with --compare, which fails if a digest differs.
+Functions whose number of calls differs from the baseline, or missing from
+it, cannot be compared: they are reported as skipped, while the digests of
+whole pages are still compared.
+"""
+import os
+import sys
+import time
+import hashlib
+import argparse
+import platform
+import tracemalloc
+
+import ujson as json
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), '..'))
+from common import extract
+from common.extract import Extractor
+
+
+CORPUS = os.path.join(os.path.dirname(__file__), 'corpus')
+
+FUNCTIONS = ['clean', 'compact', 'dropNested', 'dropSpans',
+             'replaceInternalLinks', 'replaceExternalLinks', 'extractLinks']
+
+
+def clean_text(text, title='benchmark'):
+    """Same calls as parse_page()."""
+    extractor = Extractor('0', 0, '', title, [])
+    return extractor.clean_text_links(text, mark_headers=True,
+                                      expand_templates=False)
+
+
+def load_corpus(corpus):
+    pages = {}
+    for i in sorted(os.listdir(corpus)):
+        if i.endswith('.wiki'):
+            with open(f'{corpus}/{i}', 'r', encoding='utf-8') as f:
+                pages[i[:-len('.wiki')]] = f.read()
+    return pages
+
+
+def _copy(args):
+    return tuple(list(x) if isinstance(x, list) else x for x in args)
+
+
+def record_calls(pages):
+    """Clean :param pages: with the functions wrapped, so that the arguments
+    of each call are recorded.
+    :return: {function name: [(args, kwargs)]}
+    """
+    calls = {name: [] for name in FUNCTIONS}
+    originals = {name: getattr(extract, name) for name in FUNCTIONS}
+
+    def recorder(name):
+        func = originals[name]
+
+        def wrapper(*args, **kwargs):
+            # dropSpans() sorts the spans in place
+            calls[name].append((_copy(args), kwargs))
+            return func(*args, **kwargs)
+        return wrapper
+
+    for name in FUNCTIONS:
+        setattr(extract, name, recorder(name))
+    try:
+        for title, text in pages.items():
+            clean_text(text, title)
+    finally:
+        for name, func in originals.items():
+            setattr(extract, name, func)
+    return calls
+
+
+def digest(results):
+    sha1 = hashlib.sha1()
+    for res in results:
+        sha1.update(repr(res).encode('utf-8'))
+    return sha1.hexdigest()
+
+
+def bench(func, calls, repeat):
+    """:return: best total time (s) of :param calls:, max peak allocated
+    (bytes) by a call, digest of the outputs.
+    """
+    best = float('inf')
+    for _ in range(repeat):
+        inputs = [(_copy(args), kwargs) for args, kwargs in calls]
+        start = time.perf_counter()
+        for args, kwargs in inputs:
+            func(*args, **kwargs)
+        best = min(best, time.perf_counter() - start)
+
+    results = []
+    peak = 0
+    tracemalloc.start()
+    for args, kwargs in calls:
+        args = _copy(args)
+        tracemalloc.reset_peak()
+        before = tracemalloc.get_traced_memory()[0]
+        results.append(func(*args, **kwargs))
+        peak = max(peak, tracemalloc.get_traced_memory()[1] - before)
+    tracemalloc.stop()
+    return best, peak, digest(results)
+
+
+def run(pages, repeat):
+    res = {
+        'python': platform.python_version(),
+        'functions': {},
+        'pages': {}
+    }
+    calls = record_calls(pages)
+    for name in FUNCTIONS:
+        t, peak, d = bench(getattr(extract, name), calls[name], repeat)
+        res['functions'][name] = {
+            'calls': len(calls[name]),
+            'time': t,
+            'peak_kb': peak / 1024,
+            'digest': d
+        }
+    # End to end, per page
+    for title, text in pages.items():
+        t, peak, d = bench(clean_text, [((text, title), {})], repeat)
+        res['pages'][title] = {
+            'size_kb': len(text.encode('utf-8')) / 1024,
+            'time': t,
+            'peak_kb': peak / 1024,
+            'digest': d
+        }
+    return res
+
+
+def compare(name, stats, baseline):
+    """:return: columns comparing :param stats: to :param baseline:, the
+    outcome: 'same', 'CHANGED' or 'skipped' if the outputs cannot be
+    compared.
+    """
+    if baseline is None:
+        return '', 'same'
+    if name not in baseline:
+        return '\t\t\tskipped (not in baseline)', 'skipped'
+    base = baseline[name]
+    speedup = base['time'] / stats['time'] if stats['time'] else float('nan')
+    cols = f'\t{base["time"] * 1000:.2f}\t{speedup:.2f}x'
+    if base.get('calls') != stats.get('calls'):
+        # The function is called differently, only pages can be compared
+        return (f'{cols}\tskipped ({base["calls"]} calls in baseline)',
+                'skipped')
+    outcome = 'same' if base['digest'] == stats['digest'] else 'CHANGED'
+    return f'{cols}\t{outcome}', outcome
+
+
+def report(res, baseline=None):
+    ok = True
+    skipped = []
+    header = 'time (ms)\tpeak (KB)\tdigest'
+    if baseline:
+        header += '\tbaseline (ms)\tspeedup\toutput'
+    print(f'function\tcalls\t{header}')
+    for name, stats in res['functions'].items():
+        cols, outcome = compare(name, stats,
+                                baseline and baseline['functions'])
+        ok &= outcome != 'CHANGED'
+        if outcome == 'skipped':
+            skipped.append(name)
+        print(f'{name}\t{stats["calls"]}\t{stats["time"] * 1000:.2f}\t'
+              f'{stats["peak_kb"]:.1f}\t{stats["digest"][:12]}{cols}')
+    print()
+    print(f'page\tsize (KB)\t{header}')
+    for title, stats in res['pages'].items():
+        cols, outcome = compare(title, stats, baseline and baseline['pages'])
+        ok &= outcome != 'CHANGED'
+        if outcome == 'skipped':
+            skipped.append(title)
+        print(f'{title}\t{stats["size_kb"]:.1f}\t'
+              f'{stats["time"] * 1000:.2f}\t{stats["peak_kb"]:.1f}\t'
+              f'{stats["digest"][:12]}{cols}')
+    if skipped:
+        print()
+        print(f'not compared with the baseline: {", ".join(skipped)}')
+    return ok
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--corpus', default=CORPUS,
+                        help='directory of wikitext pages (*.wiki) '
+                        '(default=benchmarks/corpus)')
+    parser.add_argument('--repeat', '-r', default=5, type=int,
+                        help='number of timed runs, the best is kept '
+                        '(default=5)')
+    parser.add_argument('--save', '-s', default=None,
+                        help='save results as a baseline (JSON)')
+    parser.add_argument('--compare', '-c', default=None,
+                        help='compare with a baseline saved by --save')
+    args = parser.parse_args()
+
+    baseline = None
+    if args.compare:
+        with open(args.compare, 'r') as f:
+            baseline = json.load(f)
+
+    res = run(load_corpus(args.corpus), args.repeat)
+    ok = report(res, baseline)
+    if args.save:
+        with open(args.save, 'w') as fw:
+            json.dump(res, fw, indent=4)
+    if not ok:
+        print('outputs differ from the baseline')
+        exit(1)
@@ -0,0 +1,147 @@
+"""Peak memory of merge_output() in parse_pages_articles_multistream.py.
+
+Generate synthetic light JSON dumps, then run the legacy dict-based merge
+and the title table merge, each in a fresh process, and report the peak
+RSS of each. Outputs of both are checked to be identical.
+"""
+import os
+import sys
+import time
+import random
+import argparse
+import resource
+import subprocess
+
+import ujson as json
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), '..'))
+
+
+def generate(outdir, num_of_titles, num_of_blocks):
+    random.seed(0)
+    os.makedirs(f'{outdir}/blocks', exist_ok=True)
+    titles = [f'Title {i} ' + 'x' * random.randint(0, 30)
+              for i in range(num_of_titles)]
+    fws = [open(f'{outdir}/blocks/b_{i}.light.tmp', 'w')
+           for i in range(num_of_blocks)]
+    for i, title in enumerate(titles):
+        if random.random() < 0.01:  # Duplicated titles
+            title = random.choice(titles)
+        d = {
+            'id': str(i + 1),
+            'title': title,
+            'redirect': None,
+            'disambiguation': False
+        }
+        r = random.random()
+        if r < 0.4:
+            d['redirect'] = random.choice(titles)
+        elif r < 0.42:
+            d['disambiguation'] = True
+        random.choice(fws).write(f'{json.dumps(d)}\n')
+    for fw in fws:
+        fw.close()
+
+
+def legacy_merge_output(outdir):
+    _redirect = {}
+    title2id = {}
+    disambiguation = set()
+    for i in os.listdir(f'{outdir}/blocks'):
+        if not i.endswith('.light.tmp'):
+            continue
+        with open(f'{outdir}/blocks/{i}', 'r') as f:
+            for line in f:
+                d = json.loads(line)
+                if d['title'] in title2id:
+                    continue
+                title2id[d['title']] = d['id']
+                if d['redirect'] is not None:
+                    _redirect[d['title']] = d['redirect']
+                if d['disambiguation']:
+                    disambiguation.add(d['title'])
+
+    redirect = {}
+    for title in _redirect:
+        re_title = _redirect[title]
+        if re_title in title2id:
+            redirect[title] = re_title
+
+    id2title = {}
+    for title in title2id:
+        _title = redirect.get(title, title)
+        id2title[title2id[title]] = {
+            'id': title2id[_title],
+            'title': _title
+        }
+
+    article = {}
+    for title in title2id:
+        if title in redirect or title in disambiguation:
+            continue
+        article[title2id[title]] = title
+
+    with open(f'{outdir}/redirect.json', 'w') as fw:
+        json.dump(redirect, fw, indent=4)
+    with open(f'{outdir}/title2id.json', 'w') as fw:
+        json.dump(title2id, fw, indent=4)
+    with open(f'{outdir}/id2title_redirected.json', 'w') as fw:
+        json.dump(id2title, fw, indent=4)
+    with open(f'{outdir}/disambiguation.json', 'w') as fw:
+        json.dump(sorted(disambiguation), fw, indent=4)
+    with open(f'{outdir}/article.json', 'w') as fw:
+        json.dump(article, fw, indent=4)
+
+
+def run(impl, outdir):
+    start = time.time()
+    if impl == 'generate':
+        generate(outdir, args.num_of_titles, args.num_of_blocks)
+        return
+    elif impl == 'legacy':
+        legacy_merge_output(outdir)
+    else:
+        from parse_pages_articles_multistream import merge_output
+        merge_output(outdir, verbose=False)
+    # Workers of the pool are accounted as children
+    peak = max(resource.getrusage(resource.RUSAGE_SELF).ru_maxrss,
+               resource.getrusage(resource.RUSAGE_CHILDREN).ru_maxrss)
+    print(json.dumps({'time': time.time() - start, 'peak_rss_kb': peak}))
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser()
+    parser.add_argument('workdir', help='working directory')
+    parser.add_argument('--num_of_titles', '-t', default=1000000, type=int,
+                        help='number of titles (default=1000000)')
+    parser.add_argument('--num_of_blocks', '-b', default=100, type=int,
+                        help='number of blocks (default=100)')
+    parser.add_argument('--impl', default=None, help=argparse.SUPPRESS)
+    args = parser.parse_args()
+
+    if args.impl:
+        run(args.impl, args.workdir)
+        exit()
+
+    # Every step runs in a fresh process, since the peak RSS of a process
+    # is inherited through fork and exec
+    cmd = [sys.executable, __file__, args.workdir,
+           '-t', str(args.num_of_titles), '-b', str(args.num_of_blocks)]
+    subprocess.run(cmd + ['--impl', 'generate'], check=True)
+    names = ['redirect', 'title2id', 'id2title_redirected', 'disambiguation',
+             'article']
+    for impl in ['legacy', 'table']:
+        res = subprocess.run(cmd + ['--impl', impl],
+                             stdout=subprocess.PIPE, check=True)
+        stats = json.loads(res.stdout.decode('utf-8').strip().split('\n')[-1])
+        print(f'{impl}\ttime: {stats["time"]:.1f}s\t'
+              f'peak RSS: {stats["peak_rss_kb"] / 1024:.0f} MB')
+        os.makedirs(f'{args.workdir}/{impl}', exist_ok=True)
+        for i in names:
+            os.replace(f'{args.workdir}/{i}.json',
+                       f'{args.workdir}/{impl}/{i}.json')
+
+    for i in names:
+        with open(f'{args.workdir}/legacy/{i}.json') as f1, \
+             open(f'{args.workdir}/table/{i}.json') as f2:
+            assert json.load(f1) == json.load(f2), f'{i}.json differs'
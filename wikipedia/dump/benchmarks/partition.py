@@ -0,0 +1,111 @@
+"""Parallel-scaling benchmark of the work partitioning of
+parse_pages_articles_multistream.py.
+
+Compare the legacy plan (every 100th stream offset, in dump order) with
+size-balanced chunks scheduled largest first. By default the runs are
+simulated, using the compressed size of a chunk as its cost. With --run,
+chunks are decompressed by a pool of workers and timed for real.
+
+The straggler tail is the time between the first worker running out of
+work and the end of the run.
+"""
+import os
+import sys
+import time
+import argparse
+import logging
+import multiprocessing
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), '..'))
+from common.multistream import read_streams, plan_chunks
+from parse_pages_articles_multistream import load_index
+
+
+logger = logging.getLogger()
+logging.basicConfig(format='%(asctime)s: %(levelname)s: %(message)s')
+logging.root.setLevel(level=logging.INFO)
+
+
+def legacy_chunks(offsets):
+    res = offsets[0::100] + [-1]
+    return list(zip(res, res[1:]))
+
+
+def chunk_size(chunk, file_size):
+    beg, end = chunk
+    return (file_size if end == -1 else end) - beg
+
+
+def simulate(costs, nworker):
+    """List scheduling: each task goes to the first idle worker.
+    :return: makespan, straggler tail
+    """
+    workers = [0] * nworker
+    for cost in costs:
+        i = workers.index(min(workers))
+        workers[i] += cost
+    return max(workers), max(workers) - min(workers)
+
+
+def decompress(p_xml, beg, end):
+    start = time.time()
+    with open(p_xml, 'rb') as f:
+        for _ in read_streams(f, beg, end):
+            pass
+    return os.getpid(), start, time.time()
+
+
+def run(p_xml, chunks, nworker):
+    pool = multiprocessing.Pool(processes=nworker)
+    start = time.time()
+    results = [pool.apply_async(decompress, args=(p_xml, beg, end,))
+               for beg, end in chunks]
+    pool.close()
+    pool.join()
+    last = {}
+    for r in results:
+        pid, _, end = r.get()
+        last[pid] = max(last.get(pid, 0), end)
+    # Workers that never got a task were idle from the start
+    first_idle = min(last.values()) if len(last) == nworker else start
+    return max(last.values()) - start, max(last.values()) - first_idle
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser()
+    parser.add_argument('p_xml',
+                        help='path to pages-articles-multistream.xml.bz')
+    parser.add_argument('p_index',
+                        help='path to pages-articles-multistream-index.txt.bz2')
+    parser.add_argument('--nworker', '-n', default='1,2,4,8,16,32',
+                        help='comma separated numbers of workers '
+                        '(default=1,2,4,8,16,32)')
+    parser.add_argument('--chunk_size', '-c', default=10,
+                        help='compressed size (MB) of a chunk (default=10)')
+    parser.add_argument('--run', default=False, action='store_true',
+                        help='decompress chunks instead of simulating')
+    args = parser.parse_args()
+
+    file_size = os.path.getsize(args.p_xml)
+    offsets = load_index(args.p_index)
+    plans = {
+        'legacy': legacy_chunks(offsets),
+        'balanced': plan_chunks(offsets, file_size,
+                                int(float(args.chunk_size) * 1024 * 1024)),
+    }
+    for name, chunks in plans.items():
+        sizes = [chunk_size(x, file_size) for x in chunks]
+        logger.info(f'{name}: {len(chunks)} chunks, size min/max: '
+                    f'{min(sizes)}/{max(sizes)} bytes')
+
+    unit = 's' if args.run else 'MB'
+    print(f'nworker\tplan\tmakespan ({unit})\ttail ({unit})')
+    for nworker in [int(x) for x in args.nworker.split(',')]:
+        for name, chunks in plans.items():
+            if args.run:
+                makespan, tail = run(args.p_xml, chunks, nworker)
+            else:
+                costs = [chunk_size(x, file_size) / 1024 / 1024
+                         for x in chunks]
+                makespan, tail = simulate(costs, nworker)
+            print(f'{nworker}\t{name}\t{makespan:.2f}\t{tail:.2f}')
@@ -0,0 +1,118 @@
+"""Scaling of template expansion in the number of invocations.
+
+Generate pages with a growing number of template invocations (citations,
+conversions, flags, nested calls) of a few templates, and time
+Extractor.expandTemplates() and Extractor.clean_text() with template
+expansion on each. Time per invocation should stay flat as pages grow.
+The legacy expansion building its result by string concatenation is timed
+as well, outputs of both are checked to be identical.
+
+The memo of expansions (extract.expansionCache) is cleared before each run,
+so only invocations repeated within a page hit it.
+"""
+import os
+import sys
+import time
+import random
+import argparse
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), '..'))
+from common import extract
+from common.extract import Extractor, findMatchingBraces
+
+
+TEMPLATES = {
+    'Template:Convert': '{{#invoke:convert|convert|{{{1}}}|{{{2}}}}}',
+    'Template:Flagicon': '<noinclude>Flag of a country</noinclude>'
+                         '[[File:Flag of {{{1}}}.svg|20px]]',
+    'Template:Cite web': '{{{author|}}} [{{{url}}} {{{title|{{{url}}}}}}]'
+                         '{{#if:{{{date|}}}|, {{{date}}}}}.',
+    'Template:Lang': "''{{{2}}}''",
+    'Template:Small': '<small>{{{1}}}</small>',
+}
+
+
+def generate(num_of_invocations):
+    random.seed(0)
+    calls = [
+        lambda i: f'{{{{convert|{i}|km}}}}',
+        lambda i: '{{flagicon|USA}}',
+        lambda i: f'{{{{cite web|url=http://example.org/{i}|title=Page {i}'
+                  f'|date=2020}}}}',
+        lambda i: f'{{{{lang|fr|{{{{small|mot {i}}}}}}}}}',
+    ]
+    res = []
+    for i in range(num_of_invocations):
+        res.append(f'Sentence {i} with [[a link]] and ')
+        res.append(random.choice(calls)(i))
+        res.append('.\n' if i % 5 == 4 else ' ')
+    return ''.join(res)
+
+
+class LegacyExtractor(Extractor):
+
+    def expandTemplates(self, wikitext):
+        res = ''
+        if len(self.frame) >= self.maxTemplateRecursionLevels:
+            self.recursion_exceeded_1_errs += 1
+            return res
+        cur = 0
+        for s, e in findMatchingBraces(wikitext, 2):
+            res += wikitext[cur:s] + self.expandTemplate(wikitext[s + 2:e - 2])
+            cur = e
+        res += wikitext[cur:]
+        return res
+
+
+def best_time(func, repeat):
+    best = float('inf')
+    for _ in range(repeat):
+        extract.expansionCache.clear()
+        start = time.perf_counter()
+        res = func()
+        best = min(best, time.perf_counter() - start)
+    return best, res
+
+
+def run(sizes, repeat):
+    for title, text in TEMPLATES.items():
+        extract.define_template(title, [text])
+    print('invocations\tsize (KB)\texpand (ms)\tus/call\t'
+          'legacy (ms)\tus/call\tclean_text (ms)\tus/call\t'
+          'cache hits\tmisses')
+    ok = True
+    for n in sizes:
+        text = generate(n)
+        t, res = best_time(
+            lambda: Extractor('0', 0, '', 'T', []).expandTemplates(text),
+            repeat)
+        t_legacy, res_legacy = best_time(
+            lambda: LegacyExtractor('0', 0, '', 'T', []).expandTemplates(text),
+            repeat)
+        ok &= res == res_legacy
+        t_clean, _ = best_time(
+            lambda: Extractor('0', 0, '', 'T', []).clean_text(
+                text, mark_headers=True, expand_templates=True,
+                html_safe=False),
+            repeat)
+        print(f'{n}\t{len(text) / 1024:.1f}\t'
+              f'{t * 1000:.1f}\t{t * 1e6 / n:.1f}\t'
+              f'{t_legacy * 1000:.1f}\t{t_legacy * 1e6 / n:.1f}\t'
+              f'{t_clean * 1000:.1f}\t{t_clean * 1e6 / n:.1f}\t'
+              f'{extract.expansionCache.hits}\t'
+              f'{extract.expansionCache.misses}')
+    return ok
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--sizes', default='1000,4000,16000',
+                        help='numbers of invocations per page, comma '
+                        'separated (default=1000,4000,16000)')
+    parser.add_argument('--repeat', '-r', default=3, type=int,
+                        help='number of timed runs, the best is kept '
+                        '(default=3)')
+    args = parser.parse_args()
+    if not run([int(x) for x in args.sizes.split(',')], args.repeat):
+        print('outputs differ from the legacy expansion')
+        exit(1)
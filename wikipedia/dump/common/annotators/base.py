@@ -1,4 +1,4 @@
-import re
+import bisect
 import logging
 
 
@@ -9,25 +9,34 @@ class Annotator:
 
     def __init__(self):
         self.segment = self._segment
+        self.segment_spans = self._segment_spans
         self.tokenize = self._tokenize
         self.nlp = None
 
     def annotate(self, text, shift=0, links=None):
+        """:param shift: offset of :param text: where annotation begins
+        """
         if links:
             text = self._preserve_links(text, links)
+            spans = sorted((link['start'], link['end']) for link in links)
+            links = ([x[0] for x in spans], [x[1] for x in spans])
 
-        shift = shift
         paragraph_index = 0
         annotated_sents = []
-        for n, para in enumerate(re.split('\n', text)):
+        pos = shift  # offset of the paragraph
+        for para in text[shift:].split('\n'):
+            offset = pos
+            pos += len(para) + 1
             if not para.strip():
                 continue
 
-            sents = self.segment(para)
+            sents = [(offset + b, offset + e)
+                     for b, e in self.segment_spans(para)]
             if links:
-                sents = self._resegment(text, shift, sents, links)
+                sents = self._resegment(sents, *links)
 
-            for sent in sents:
+            for start, end in sents:
+                sent = text[start:end]
                 if self.nlp:
                     try:
                         toks, nlp_res = self.nlp(sent.replace('_', ' '))
@@ -38,9 +47,6 @@ class Annotator:
                 else:
                     toks = self.tokenize(sent.replace('_', ' '))
                     nlp_res = {}
-                start = text.index(sent, shift)
-                end = start + len(sent)
-                shift = end
                 annotated_sents.append({
                     'tokens': toks,
                     'start': start,
@@ -57,37 +63,40 @@ class Annotator:
         e.g., anchor text `"Hello, World!" program` may be split
         by some sentence segmentors. Hence, replace whitespace with underline
         """
-        for link in links:
-            b = link['start']
-            e = link['end']
-            text = text[:b] + text[b:e].replace(' ', '_') + text[e:]
-        return text
+        res = []
+        cur = 0
+        # Spans in order, overlapping ones are replaced once
+        for b, e in sorted((link['start'], link['end']) for link in links):
+            b = max(b, cur)
+            if b >= e:
+                continue
+            res.append(text[cur:b])
+            res.append(text[b:e].replace(' ', '_'))
+            cur = e
+        res.append(text[cur:])
+        return ''.join(res)
 
     @staticmethod
-    def _resegment(text, shift, sents, links):
+    def _resegment(sents, starts, ends):
         """_preserve_links(**kwargs) doesn't always succeed, we need to
-        resegment sentences.
+        resegment sentences: a sentence is merged with the following ones
+        until the links starting in it end in it.
+        :param sents: sorted (start, end) of sentences
+        :param starts: sorted starts of links, :param ends: their ends
         """
         new_sents = []
-        n = 0
-        shift = shift
-        for i, sent in enumerate(sents):
-            if n > i:
-                continue
-            start = text.index(sent, shift)
-            end = start + len(sent)
-            shift = end
-            for link in links:
-                while link['start'] >= start and link['start'] < end and \
-                      link['end'] > end:
+        i = 0
+        while i < len(sents):
+            start, end = sents[i]
+            j = bisect.bisect_left(starts, start)
+            while j < len(starts) and starts[j] < end:
+                if ends[j] > end and i + 1 < len(sents):
                     i += 1
-                    if i >= len(sents):
-                        break
-                    sent += text[end:text.index(sents[i], end)+len(sents[i])]
-                    end = start + len(sent)
-            shift = end
-            n = i + 1
-            new_sents.append(sent)
+                    end = sents[i][1]
+                else:
+                    j += 1
+            new_sents.append((start, end))
+            i += 1
         return new_sents
 
     def _segment(self, text):
@@ -97,6 +106,19 @@ class Annotator:
         sents = []
         return sents
 
+    def _segment_spans(self, text):
+        """Sentence segmentation
+        Split string into a list of (start, end) offsets. Segmenters
+        returning substrings of the text only are searched for in order.
+        """
+        spans = []
+        end = 0
+        for sent in self.segment(text):
+            start = text.index(sent, end)
+            end = start + len(sent)
+            spans.append((start, end))
+        return spans
+
     def _tokenize(self, text):
         """Tokenization
         Split string into a list of string.
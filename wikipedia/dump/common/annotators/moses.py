@@ -1,7 +1,7 @@
 import logging
 
 from nltk.tokenize.moses import MosesTokenizer
-from nltk.tokenize import sent_tokenize as punkt
+from .punkt import get_punkt
 
 from .base import Annotator
 
@@ -22,7 +22,10 @@ class MosesAnnotator(Annotator):
         logger.info('done.')
 
     def _segment(self, text):
-        return punkt(text)
+        return get_punkt().tokenize(text)
+
+    def _segment_spans(self, text):
+        return list(get_punkt().span_tokenize(text))
 
     def _tokenize(self, text, shift=0):
         toks = []
@@ -0,0 +1,19 @@
+import nltk
+
+
+# Pretrained punkt tokenizers loaded, per language
+_tokenizers = {}
+
+
+def get_punkt(language='english'):
+    """:return: the punkt tokenizer of nltk.sent_tokenize() for
+    :param language:, loaded once per process.
+    """
+    if language not in _tokenizers:
+        try:
+            from nltk.tokenize import PunktTokenizer  # nltk >= 3.8.2
+            _tokenizers[language] = PunktTokenizer(language)
+        except ImportError:
+            _tokenizers[language] = nltk.data.load(
+                f'tokenizers/punkt/{language}.pickle')
+    return _tokenizers[language]
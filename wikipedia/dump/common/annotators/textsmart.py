@@ -25,16 +25,17 @@ class TextsmartAnnotator(Annotator):
         logger.info('done.')
 
     def _segment(self, text):
-        sents = []
+        return [text[b:e] for b, e in self._segment_spans(text)]
+
+    def _segment_spans(self, text):
+        spans = []
         sent_end_char = [u'。', u'！', u'？']
-        current_sent = ''
-        for i, char in enumerate(list(text)):
-            if char in sent_end_char or i == len(list(text)) - 1:
-                sents.append(current_sent + char)
-                current_sent = ''
-            else:
-                current_sent += char
-        return sents
+        start = 0
+        for i, char in enumerate(text):
+            if char in sent_end_char or i == len(text) - 1:
+                spans.append((start, i + 1))
+                start = i + 1
+        return spans
 
     def _nlp(self, text, shift=0):
         obj = {"str": text}
@@ -1,13 +1,58 @@
+import re
+import sys
 import logging
 
 import unicodedata as ud
-from nltk.tokenize import sent_tokenize as punkt
+from .punkt import get_punkt
 
 from .base import Annotator
 
 
 logger = logging.getLogger()
 
+# Kept within tokens
+APOSTROPHES = ['ʼ', '’', '‘', '´', '′', "'"]
+
+# Tokens of unitok, compiled on first use, see _unitok_regex()
+_unitok = None
+
+
+def _char_class(chars):
+    """Character class of a regex matching :param chars:, sorted."""
+    ranges = []
+    for c in chars:
+        if ranges and ord(c) == ord(ranges[-1][1]) + 1:
+            ranges[-1][1] = c
+        else:
+            ranges.append([c, c])
+    return ''.join(re.escape(b) if b == e else f'{re.escape(b)}-{re.escape(e)}'
+                   for b, e in ranges)
+
+
+def _unitok_regex():
+    """Punctuation and symbols (Unicode categories P* and S*, besides
+    apostrophes) are tokens of their own, other tokens are runs of the
+    other characters but whitespace.
+    """
+    global _unitok
+    if _unitok is None:
+        chars = []
+        for i in range(sys.maxunicode + 1):
+            char = chr(i)
+            if char in APOSTROPHES:
+                continue
+            if ud.category(char)[0] in 'PS' or char in ['።', '፡']:
+                chars.append(char)
+        # Classes beyond the BMP are lists of ranges tried one by one, they
+        # are only tried for characters beyond the BMP
+        bmp = _char_class([x for x in chars if x <= '\uffff'])
+        astral = _char_class([x for x in chars if x > '\uffff'])
+        other = '\U00010000-\U0010ffff'
+        punct = f'[{bmp}]|[{other}](?<=[{astral}])'
+        word = f'[^{bmp}{other}\\s]|[{other}](?<![{astral}])'
+        _unitok = re.compile(f'{punct}|(?:{word})+')
+    return _unitok
+
 
 class UnitokAnnotator(Annotator):
     """Universal Annotator
@@ -18,42 +63,26 @@ class UnitokAnnotator(Annotator):
     def __init__(self):
         logger.info('initializing unitok annotator...')
         super().__init__()
+        # Compiled before workers are forked
+        _unitok_regex()
         logger.info('done.')
 
     def _segment(self, text):
-        return punkt(text)
+        return get_punkt().tokenize(text)
+
+    def _segment_spans(self, text):
+        return list(get_punkt().span_tokenize(text))
 
     def _tokenize(self, text, shift=0):
         toks = []
-        index = 0
-        for tok in self._unitok_tokenize(text):
-            if tok.strip() == '':
-                index += len(tok)
-                continue
-            tok_start = text.index(tok, index)
-            tok_end = tok_start + len(tok)
+        for m in _unitok_regex().finditer(text):
             toks.append({
-                'text': tok,
-                'start': tok_start + shift,
-                'end': tok_end + shift
+                'text': m.group(),
+                'start': m.start() + shift,
+                'end': m.end() + shift
             })
-            index = tok_end
         return toks
 
     @staticmethod
     def _unitok_tokenize(data):
-        toks = []
-        for offset, char in enumerate(data):
-            cc = ud.category(char)
-            if char in ['ʼ', '’', '‘', '´', '′', "'"]:
-                toks.append(char)
-            elif cc.startswith("P") \
-                 or cc.startswith("S") \
-                 or char in ['።', '፡']:
-                toks.append(' ')
-                toks.append(char)
-                toks.append(' ')
-            else:
-                toks.append(char)
-        toks = [item for item in ''.join(toks).split() if item]
-        return toks
+        return _unitok_regex().findall(data)
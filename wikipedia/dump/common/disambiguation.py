@@ -0,0 +1,61 @@
+import re
+
+
+# Openings of templates and their names, up to the first parameter
+RE_TEMPLATE_NAME = re.compile(r'{{([^{}|\n]*)')
+
+# Names of templates marking disambiguation pages, lowercased, per language
+# wiki, see Special:WhatLinksHere/Template:Disambiguation of each wiki
+DISAMBIGUATION_TEMPLATES = {
+    'en': ['disambiguation', 'disambig', 'disamb', 'dab', 'geodis',
+           'hndis', 'numberdis', 'schooldis', 'roaddis', 'mil-unit-dis'],
+    'de': ['begriffsklärung'],
+    'es': ['desambiguación', 'desambiguacion', 'des'],
+    'fr': ['homonymie', 'patronymie', 'toponymie'],
+    'it': ['disambigua'],
+    'ja': ['aimai', '曖昧さ回避', '人名の曖昧さ回避', '地名の曖昧さ回避'],
+    'nl': ['dp', 'dpintro'],
+    'pl': ['disambig', 'ujednoznacznienie'],
+    'pt': ['desambiguação', 'desambig'],
+    'ru': ['неоднозначность', 'disambig', 'многозначность'],
+    'sv': ['förgrening', 'förgreningssida'],
+    'zh': ['disambig', '消歧义', '消歧義'],
+}
+
+# Rules of the former regular expressions, {{disambiguation...}},
+# {{...disambiguation}} and {{hndis...}}, kept for every language
+PREFIXES = ('disambiguation', 'hndis')
+SUFFIXES = ('disambiguation',)
+
+
+class Disambiguation():
+    """Classify pages as disambiguation pages by the names of the templates
+    they use, found in one scan of the template openings of the page.
+    """
+
+    def __init__(self, lang=None):
+        """:param lang: language code of the wiki, English templates are
+        looked for if None or unknown: templates of other languages, e.g.
+        'des' or 'dp', may be anything there.
+        """
+        if lang not in DISAMBIGUATION_TEMPLATES:
+            lang = 'en'
+        self.names = frozenset(DISAMBIGUATION_TEMPLATES[lang])
+
+    def is_template(self, name):
+        name = ' '.join(name.replace('_', ' ').split()).lower()
+        if name.startswith('template:'):
+            name = name[len('template:'):].lstrip()
+        return name in self.names or name.startswith(PREFIXES) or \
+            name.endswith(SUFFIXES)
+
+    def __call__(self, text, redirect=None):
+        """:return: whether :param text: is the wikitext of a disambiguation
+        page, redirects (:param redirect: set) never are.
+        """
+        if redirect:
+            return False
+        for m in RE_TEMPLATE_NAME.finditer(text):
+            if self.is_template(m.group(1)):
+                return True
+        return False
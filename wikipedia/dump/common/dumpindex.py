@@ -0,0 +1,168 @@
+import os
+import bz2
+import mmap
+import bisect
+import struct
+import logging
+from array import array
+
+
+logger = logging.getLogger()
+
+MAGIC = b'WKIDX001'
+HEADER = struct.Struct('<8sQQQ')  # magic, # of pages, # of streams, blob size
+
+
+def build_index_cache(p_index, p_cache):
+    """Convert pages-articles-multistream-index.txt.bz2 into a binary file.
+
+    Layout, arrays are unsigned 64-bit integers in native byte order:
+      header
+      streams[# of streams]   sorted distinct stream offsets
+      ids[# of pages]         sorted page ids
+      id_rank[# of pages]     rank of the title of ids[i]
+      title_pos[# of pages+1] position of the i-th title in blob
+      title_offset[# of pages] stream offset of the i-th title
+      title_id[# of pages]    page id of the i-th title
+      blob                    utf-8 titles, sorted
+    """
+    offsets = array('Q')
+    ids = array('Q')
+    titles = []
+    with bz2.open(p_index, 'rb') as f:
+        for line in f:
+            offset, page_id, title = line.rstrip(b'\n').split(b':', 2)
+            offsets.append(int(offset))
+            ids.append(int(page_id))
+            titles.append(title)
+    n = len(titles)
+
+    # UTF-8 byte order is the same as code point order
+    title_order = sorted(range(n), key=titles.__getitem__)
+    rank = array('Q', bytes(8 * n))
+    for r, i in enumerate(title_order):
+        rank[i] = r
+    id_order = sorted(range(n), key=ids.__getitem__)
+
+    streams = array('Q', sorted(set(offsets)))
+    title_pos = array('Q', [0])
+    for i in title_order:
+        title_pos.append(title_pos[-1] + len(titles[i]))
+    blob = b''.join(titles[i] for i in title_order)
+
+    tmp = f'{p_cache}.tmp'
+    with open(tmp, 'wb') as fw:
+        fw.write(HEADER.pack(MAGIC, n, len(streams), len(blob)))
+        streams.tofile(fw)
+        array('Q', (ids[i] for i in id_order)).tofile(fw)
+        array('Q', (rank[i] for i in id_order)).tofile(fw)
+        title_pos.tofile(fw)
+        array('Q', (offsets[i] for i in title_order)).tofile(fw)
+        array('Q', (ids[i] for i in title_order)).tofile(fw)
+        fw.write(blob)
+    os.replace(tmp, p_cache)
+
+
+class DumpIndex():
+    """Memory-mapped multistream index.
+    Lookups by page id or title are binary searches over sorted arrays.
+    """
+
+    def __init__(self, p_cache):
+        with open(p_cache, 'rb') as f:
+            self._mm = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+        magic, n, nstreams, _ = HEADER.unpack_from(self._mm)
+        if magic != MAGIC:
+            raise ValueError(f'Not a multistream index cache: {p_cache}')
+        self._n = n
+        view = memoryview(self._mm)
+        pos = HEADER.size
+
+        def take(size):
+            nonlocal pos
+            res = view[pos:pos + 8 * size].cast('Q')
+            pos += 8 * size
+            return res
+        self.streams = take(nstreams)
+        self._ids = take(n)
+        self._id_rank = take(n)
+        self._title_pos = take(n + 1)
+        self._title_offset = take(n)
+        self._title_id = take(n)
+        self._blob = pos
+
+    @classmethod
+    def load(cls, p_index, p_cache=None):
+        """Open the cache of :param p_index:, build it if it is missing or
+        older than the index.
+        """
+        if p_cache is None:
+            p_cache = f'{p_index}.cache'
+        if not os.path.exists(p_cache) or \
+           os.path.getmtime(p_cache) < os.path.getmtime(p_index):
+            logger.info(f'building index cache: {p_cache}')
+            build_index_cache(p_index, p_cache)
+        return cls(p_cache)
+
+    def __len__(self):
+        return self._n
+
+    def stream_offsets(self):
+        return self.streams.tolist()
+
+    def stream_end(self, offset):
+        """:return: offset of the stream following the one at :param offset:,
+        -1 if it is the last one.
+        """
+        i = bisect.bisect_left(self.streams, offset)
+        if i + 1 < len(self.streams):
+            return self.streams[i + 1]
+        return -1
+
+    def _title(self, rank):
+        beg = self._blob + self._title_pos[rank]
+        end = self._blob + self._title_pos[rank + 1]
+        return self._mm[beg:end]
+
+    def _entry(self, rank):
+        return (self._title_offset[rank],
+                self._title_id[rank],
+                self._title(rank).decode('utf-8'))
+
+    def find_by_id(self, page_id):
+        """:return: (stream offset, page id, title), None if not found."""
+        page_id = int(page_id)
+        i = bisect.bisect_left(self._ids, page_id)
+        if i < self._n and self._ids[i] == page_id:
+            return self._entry(self._id_rank[i])
+        return None
+
+    def find_by_title(self, title):
+        """:return: (stream offset, page id, title), None if not found."""
+        title = title.encode('utf-8')
+        i = self._bisect_title(title)
+        if i < self._n and self._title(i) == title:
+            return self._entry(i)
+        return None
+
+    def find_by_prefix(self, prefix):
+        """:return: sorted distinct stream offsets of the titles starting
+        with :param prefix:, e.g. the pages of a namespace.
+        """
+        prefix = prefix.encode('utf-8')
+        res = set()
+        i = self._bisect_title(prefix)
+        while i < self._n and self._title(i).startswith(prefix):
+            res.add(self._title_offset[i])
+            i += 1
+        return sorted(res)
+
+    def _bisect_title(self, title):
+        lo, hi = 0, self._n
+        while lo < hi:
+            mid = (lo + hi) // 2
+            if self._title(mid) < title:
+                lo = mid + 1
+            else:
+                hi = mid
+        return lo
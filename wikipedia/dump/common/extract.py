@@ -21,11 +21,14 @@
 import re
 import html
 import json
-from itertools import zip_longest
+from itertools import zip_longest, accumulate, count
 from urllib.parse import quote as urlencode
 from html.entities import name2codepoint
 import logging
 import time
+import bisect
+from collections import OrderedDict
+from types import MappingProxyType
 
 # ----------------------------------------------------------------------
 
@@ -40,6 +43,12 @@ syntaxhighlight = re.compile('&lt;syntaxhighlight .*?&gt;(.*?)&lt;/syntaxhighlig
 # We include as default Template, when loading external template file.
 knownNamespaces = set(['Template'])
 
+##
+# The namespace used for template definitions
+# It is the name associated with namespace key=10 in the siteinfo header.
+templateNamespace = 'Template'
+templatePrefix = templateNamespace + ':'
+
 ##
 # Drop these elements from article text
 #
@@ -60,6 +69,18 @@ discardElements = [
 acceptedNamespaces = ['w', 'wiktionary', 'wikt']
 unacceptedNamespaces = ['category', 'file', 'image']
 
+##
+# Markers of links in cleaned text, noncharacters which no cleaning step
+# alters: INTERNAL_LINK or EXTERNAL_LINK, target, LINK_LABEL, label,
+# LINK_END. See extractLinks(). They are removed from the text of pages
+# before links are marked, the ones found there are not links.
+INTERNAL_LINK = '\ufdd0'
+EXTERNAL_LINK = '\ufdd1'
+LINK_LABEL = '\ufdd2'
+LINK_END = '\ufdd3'
+LINK_MARKERS = INTERNAL_LINK + EXTERNAL_LINK + LINK_LABEL + LINK_END
+linkMarkerChars = re.compile('[%s]' % LINK_MARKERS)
+
 
 def get_url(urlbase, uid):
     return "%s?curid=%s" % (urlbase, uid)
@@ -87,6 +108,9 @@ def clean(extractor, text, expand_templates=False, html_safe=True):
         # Drop transclusions (template, parser functions)
         text = dropNested(text, r'{{', r'}}')
 
+    # Drop markers of links found in the page or its templates
+    text = linkMarkerChars.sub('', text)
+
     # Drop tables
     text = dropNested(text, r'{\|', r'\|}')
 
@@ -102,13 +126,14 @@ def clean(extractor, text, expand_templates=False, html_safe=True):
     # ############### Process HTML ###############
 
     # turn into HTML, except for the content of <syntaxhighlight>
-    res = ''
+    res = []
     cur = 0
     for m in syntaxhighlight.finditer(text):
-        end = m.end()
-        res += unescape(text[cur:m.start()]) + m.group(1)
-        cur = end
-    text = res + unescape(text[cur:])
+        res.append(unescape(text[cur:m.start()]))
+        res.append(m.group(1))
+        cur = m.end()
+    res.append(unescape(text[cur:]))
+    text = ''.join(res)
 
     # Handle bold/italic/quote
     if extractor.HtmlFormatting:
@@ -124,31 +149,14 @@ def clean(extractor, text, expand_templates=False, html_safe=True):
     # residuals of unbalanced quotes
     text = text.replace("'''", '').replace("''", '"')
 
-    # Collect spans
-
-    spans = []
-    # Drop HTML comments
-    for m in comment.finditer(text):
-        spans.append((m.start(), m.end()))
-
-    # Drop self-closing tags
-    for pattern in selfClosing_tag_patterns:
-        for m in pattern.finditer(text):
-            spans.append((m.start(), m.end()))
-
-    # Drop ignored tags
-    for left, right in ignored_tag_patterns:
-        for m in left.finditer(text):
-            spans.append((m.start(), m.end()))
-        for m in right.finditer(text):
-            spans.append((m.start(), m.end()))
+    # Collect spans of HTML comments, self-closing tags and ignored tags
+    spans = collectTagSpans(text)
 
     # Bulk remove all spans
     text = dropSpans(spans, text)
 
     # Drop discarded elements
-    for tag in discardElements:
-        text = dropNested(text, r'<\s*%s\b[^>/]*>' % tag, r'<\s*/\s*%s>' % tag)
+    text = dropDiscarded(text)
 
     if not extractor.HtmlFormatting:
         # Turn into text what is left (&amp;nbsp;) and <syntaxhighlight>
@@ -156,10 +164,7 @@ def clean(extractor, text, expand_templates=False, html_safe=True):
 
     # Expand placeholders
     for pattern, placeholder in placeholder_tag_patterns:
-        index = 1
-        for match in pattern.finditer(text):
-            text = text.replace(match.group(), '%s_%d' % (placeholder, index))
-            index += 1
+        text = expandPlaceholders(text, pattern, placeholder)
 
     text = text.replace('<<', u'«').replace('>>', u'»')
 
@@ -167,17 +172,73 @@ def clean(extractor, text, expand_templates=False, html_safe=True):
 
     # Cleanup text
     text = text.replace('\t', ' ')
-    text = spaces.sub(' ', text)
-    text = dots.sub('...', text)
+    # Skip scans that cannot match
+    if '  ' in text:
+        text = spaces.sub(' ', text)
+    if '....' in text:
+        text = dots.sub('...', text)
     text = re.sub(u' (,:\.\)\]»)', r'\1', text)
     text = re.sub(u'(\[\(«) ', r'\1', text)
-    text = re.sub(r'\n\W+?\n', '\n', text, flags=re.U)  # lines with only punctuations
+    text = punctuationLine.sub('\n', text)  # lines with only punctuations
     text = text.replace(',,', ',').replace(',.', '.')
     if html_safe:
-        text = html.escape(text, quote=False)
+        text = html.escape(linksToHtml(text), quote=False)
     return text
 
 
+# Lines with only punctuations, links are not
+punctuationLine = re.compile(r'\n[^\w%s]+?\n' % LINK_MARKERS)
+
+# A link marked by makeInternalLink() or makeExternalLink(), or what is left
+# of one, e.g. spanning lines or dropped in part: its target, or a marker.
+linkMarkers = re.compile(
+    r'([{start}])([^{all}\n]*){label}([^{all}\n]*){end}'
+    r'|[{start}][^{all}\n]*{label}|[{all}]'.format(
+        start=INTERNAL_LINK + EXTERNAL_LINK, all=LINK_MARKERS,
+        label=LINK_LABEL, end=LINK_END))
+
+linkTypes = {INTERNAL_LINK: 'internal', EXTERNAL_LINK: 'external'}
+
+
+def extractLinks(text):
+    """
+    Replace the links marked in :param text: with their labels, in a single
+    pass.
+    :return: the text, the list of (start, end, target, type) of its links,
+      type is 'internal' or 'external'. Links without target are left out.
+    """
+    res = []
+    links = []
+    pos = 0  # length of the result so far
+    cur = 0
+    for m in linkMarkers.finditer(text):
+        res.append(text[cur:m.start()])
+        pos += m.start() - cur
+        cur = m.end()
+        if not m.group(1):  # part of a link
+            continue
+        target, label = m.group(2), m.group(3)
+        if not label:
+            label = target
+        if target:
+            links.append((pos, pos + len(label), target,
+                          linkTypes[m.group(1)]))
+        res.append(label)
+        pos += len(label)
+    res.append(text[cur:])
+    return ''.join(res), links
+
+
+def linksToHtml(text):
+    """Turn the links marked in :param text: into HTML anchors."""
+    def anchor(m):
+        if not m.group(1):  # part of a link
+            return ''
+        return '<a href="%s" type="%s">%s</a>' % (
+            m.group(2), linkTypes[m.group(1)], m.group(3))
+    return linkMarkers.sub(anchor, text)
+
+
 # skip level 1, it is page name level
 section = re.compile(r'(==+)\s*(.*?)\s*\1')
 
@@ -297,51 +358,216 @@ def dropNested(text, openDelim, closeDelim):
     """
     openRE = re.compile(openDelim, re.IGNORECASE)
     closeRE = re.compile(closeDelim, re.IGNORECASE)
-    # partition text in separate blocks { } { }
+
+    def search(pattern):
+        def f(pos):
+            m = pattern.search(text, pos)
+            return m and m.span()
+        return f
+    spans = nestedSpans(search(openRE), search(closeRE))
+    if not spans:
+        return text
+    return dropSpans(spans, text)
+
+
+def nestedSpans(searchOpen, searchClose):
+    """
+    Partition text in separate blocks { } { }, of nested delimiters.
+    :param searchOpen: returns the (start, end) of the first opening
+      delimiter at or after a position, None if there is none. Likewise for
+      :param searchClose:.
+    :return: list of the (start, end) of the blocks.
+    """
     spans = []  # pairs (s, e) for each partition
     nest = 0  # nesting level
-    start = openRE.search(text, 0)
+    start = searchOpen(0)
     if not start:
-        return text
-    end = closeRE.search(text, start.end())
+        return spans
+    end = searchClose(start[1])
     next = start
     while end:
-        next = openRE.search(text, next.end())
+        next = searchOpen(next[1])
         if not next:  # termination
             while nest:  # close all pending
                 nest -= 1
-                end0 = closeRE.search(text, end.end())
+                end0 = searchClose(end[1])
                 if end0:
                     end = end0
                 else:
                     break
-            spans.append((start.start(), end.end()))
+            spans.append((start[0], end[1]))
             break
-        while end.end() < next.start():
+        while end[1] < next[0]:
             # { } {
             if nest:
                 nest -= 1
                 # try closing more
-                last = end.end()
-                end = closeRE.search(text, end.end())
+                last = end[1]
+                end = searchClose(end[1])
                 if not end:  # unbalanced
                     if spans:
                         span = (spans[0][0], last)
                     else:
-                        span = (start.start(), last)
+                        span = (start[0], last)
                     spans = [span]
                     break
             else:
-                spans.append((start.start(), end.end()))
+                spans.append((start[0], end[1]))
                 # advance start, find next close
                 start = next
-                end = closeRE.search(text, next.end())
+                end = searchClose(next[1])
                 break  # { }
-        if next != start:
+        if next is not start:
             # { { }
             nest += 1
-    # collect text outside partitions
-    return dropSpans(spans, text)
+    return spans
+
+
+# Patterns of discardElements, by the list they are compiled from
+_discardPatterns = {}
+
+
+def discardPatterns():
+    """
+    :return: [(tag, open pattern, close pattern)] of discardElements, a
+      pattern of the beginning of any of their tags, capturing '/' of
+      closing tags and the name, and the indexes of patterns by tag name.
+    """
+    key = tuple(discardElements)
+    if key not in _discardPatterns:
+        patterns = [
+            (tag,
+             re.compile(r'<\s*%s\b[^>/]*>' % tag, re.IGNORECASE),
+             re.compile(r'<\s*/\s*%s>' % tag, re.IGNORECASE))
+            for tag in discardElements]
+        # Same case folding as the patterns
+        tagStart = re.compile(r'<\s*(/\s*)?(%s)\b' % '|'.join(discardElements),
+                              re.IGNORECASE)
+        byName = {}
+        for i, tag in enumerate(discardElements):
+            byName.setdefault(tag.lower(), []).append(i)
+        _discardPatterns.clear()
+        _discardPatterns[key] = (patterns, tagStart, byName)
+    return _discardPatterns[key]
+
+
+def dropDiscarded(text):
+    """
+    Drop the elements of discardElements, with the same result as calling
+    dropNested() for each tag in turn, but scanning the text once.
+    Opening and closing tags of all elements are collected in one pass over
+    the tags of the text. The elements are then partitioned tag after tag,
+    in original coordinates, skipping tags inside already dropped elements,
+    and all of them are dropped at once.
+    Dropping an element could split a tag of another element, or join two
+    pieces of text into a new tag, e.g. '<' + '<ref>..</ref>' + 'div>'. Such
+    cases fall back to calling dropNested() in turn.
+    """
+    patterns, tagStart, byName = discardPatterns()
+    opens = [[] for _ in patterns]
+    closes = [[] for _ in patterns]
+    resume = {}  # pattern -> end of its last match
+
+    def match(pattern, pos, tokens):
+        if resume.get(pattern, 0) <= pos:
+            m = pattern.match(text, pos)
+            if m:
+                tokens.append(m.span())
+                resume[pattern] = m.end()
+
+    for m in tagStart.finditer(text):
+        slash, name = m.groups()
+        if name.isascii():
+            candidates = byName[name.lower()]
+        else:
+            # Folded to ASCII by case-insensitive matching
+            candidates = range(len(patterns))
+        for i in candidates:
+            if slash:
+                match(patterns[i][2], m.start(), closes[i])
+            else:
+                match(patterns[i][1], m.start(), opens[i])
+
+    dropped = []  # sorted disjoint spans
+
+    def state(span):
+        """:return: 'out' of dropped spans, 'in' one, or 'cut' by one."""
+        s, e = span
+        i = bisect.bisect_right(dropped, (s, float('inf')))
+        if i and dropped[i - 1][1] > s:
+            return 'in' if dropped[i - 1][1] >= e else 'cut'
+        if i < len(dropped) and dropped[i][0] < e:
+            return 'cut'
+        return 'out'
+
+    def joins(s):
+        """Whether the text left on the left of a span may end with the
+        beginning of a tag, i.e. a '<' not followed by '>'.
+        """
+        k = bisect.bisect_left(dropped, (s, s))
+        while True:
+            beg = dropped[k - 1][1] if k else 0
+            lt, gt = text.rfind('<', beg, s), text.rfind('>', beg, s)
+            if lt != gt:  # at least one of them is found
+                return lt > gt
+            if not k:
+                return False
+            k -= 1
+            s = dropped[k][0]
+
+    for i in range(len(patterns)):
+        if not opens[i]:
+            continue
+        # Tags are partitioned at their positions in the text left by the
+        # elements dropped so far, where they may have become adjacent
+        starts = [s for s, e in dropped]
+        shifts = list(accumulate(e - s for s, e in dropped))
+
+        def shift(pos):
+            k = bisect.bisect_left(starts, pos)
+            return pos - shifts[k - 1] if k else pos
+        tokens = ([], [])
+        origin = ({}, {})  # shifted start of opening tags, end of closing
+        for j, found in enumerate((opens[i], closes[i])):
+            for span in found:
+                where = state(span)
+                if where == 'cut':
+                    return dropDiscardedInTurn(text)
+                if where == 'out':
+                    tokens[j].append((shift(span[0]), shift(span[1])))
+                    origin[j][tokens[j][-1][j]] = span[j]
+
+        def search(found):
+            beg = [s for s, e in found]
+
+            def f(pos):
+                k = bisect.bisect_left(beg, pos)
+                return found[k] if k < len(found) else None
+            return f
+        spans = nestedSpans(search(tokens[0]), search(tokens[1]))
+
+        # Spans actually dropped by dropSpans()
+        spans.sort()
+        offset = 0
+        for s, e in spans:
+            if offset <= s:
+                offset = e
+                s, e = origin[0][s], origin[1][e]
+                if joins(s):
+                    return dropDiscardedInTurn(text)
+                k = bisect.bisect_left(dropped, (s, s))
+                # Dropped spans within this one are merged into it
+                n = k
+                while n < len(dropped) and dropped[n][1] <= e:
+                    n += 1
+                dropped[k:n] = [(s, e)]
+    return dropSpans(dropped, text)
+
+
+def dropDiscardedInTurn(text):
+    for tag, openRE, closeRE in discardPatterns()[0]:
+        text = dropNested(text, openRE.pattern, closeRE.pattern)
+    return text
 
 
 def dropSpans(spans, text):
@@ -435,7 +661,7 @@ def makeExternalLink(url, anchor):
     """Function applied to wikiLinks"""
     if Extractor.keepLinks:
         # return '<a href="%s">%s</a>' % (urlencode(url), anchor)
-        return '<a href="%s" type="external">%s</a>' % (url, anchor)
+        return f'{EXTERNAL_LINK}{url}{LINK_LABEL}{anchor}{LINK_END}'
     else:
         return anchor
 
@@ -513,7 +739,7 @@ def makeInternalLink(title, label):
     if Extractor.keepLinks:
         # return '<a href="%s">%s</a>' % (urlencode(title), label)
         # return '[[%s|%s]]' % (title, label)
-        return '<a href="%s" type="internal">%s</a>' % (title, label)
+        return f'{INTERNAL_LINK}{title}{LINK_LABEL}{label}{LINK_END}'
     else:
         return label
 
@@ -611,6 +837,7 @@ class MagicWords():
 
     def __init__(self):
         self.values = {'!': '|'}
+        self.values.update(runMagicWords)
 
     def __getitem__(self, name):
         return self.values.get(name)
@@ -642,6 +869,15 @@ class MagicWords():
 
 magicWordsRE = re.compile('|'.join(MagicWords.switches))
 
+# Magic words of the time of the run, computed once for all pages
+runMagicWords = {
+    'currentyear': time.strftime('%Y'),
+    'currentmonth': time.strftime('%m'),
+    'currentday': time.strftime('%d'),
+    'currenthour': time.strftime('%H'),
+    'currenttime': time.strftime('%H:%M:%S'),
+}
+
 
 # =========================================================================
 #
@@ -748,9 +984,11 @@ def unescape(text):
         try:
             if text[1] == "#":  # character reference
                 if text[2] == "x":
-                    return chr(int(code[1:], 16))
+                    char = chr(int(code[1:], 16))
                 else:
-                    return chr(int(code))
+                    char = chr(int(code))
+                # references to markers of links are not links
+                return '' if char in LINK_MARKERS else char
             else:  # named entity
                 return chr(name2codepoint[code])
         except:
@@ -765,17 +1003,21 @@ comment = re.compile(r'<!--.*?-->', re.DOTALL)
 
 # Match ignored tags
 ignored_tag_patterns = []
+# Same patterns by lowercase tag name, see collectTagSpans()
+ignored_tag_index = {}
 
 
 def ignoreTag(tag):
     left = re.compile(r'<%s\b.*?>' % tag, re.IGNORECASE | re.DOTALL)  # both <ref> and <reference>
     right = re.compile(r'</\s*%s>' % tag, re.IGNORECASE)
     ignored_tag_patterns.append((left, right))
+    ignored_tag_index.setdefault(tag.lower(), []).append((left, right))
 
 
 def resetIgnoredTags():
-    global ignored_tag_patterns
+    global ignored_tag_patterns, ignored_tag_index
     ignored_tag_patterns = []
+    ignored_tag_index = {}
 
 
 for tag in ignoredTags:
@@ -785,6 +1027,64 @@ for tag in ignoredTags:
 selfClosing_tag_patterns = [
     re.compile(r'<\s*%s\b[^>]*/\s*>' % tag, re.DOTALL | re.IGNORECASE) for tag in selfClosingTags
 ]
+selfClosing_tag_index = dict(zip(selfClosingTags, selfClosing_tag_patterns))
+
+# Beginning of a comment, of a closing tag, or of an opening or self-closing
+# tag, whose name is captured
+tagStart = re.compile(r'<(?:(!--)|/\s*(\w+)|(\s*)(\w+))')
+
+
+def collectTagSpans(text):
+    """
+    Collect the spans of comments, self-closing tags and ignored tags in a
+    single pass over the tags of :param text:.
+    Every pattern starts with '<' followed by the tag name, so it is only
+    matched where a tag of that name starts, and not before the end of its
+    previous match: the result is the same as scanning the text with
+    finditer() for each pattern in turn.
+    """
+    spans = []
+    resume = {}  # pattern -> end of its last match
+
+    def match(pattern, pos):
+        if resume.get(pattern, 0) <= pos:
+            m = pattern.match(text, pos)
+            if m:
+                spans.append((m.start(), m.end()))
+                resume[pattern] = m.end()
+
+    for m in tagStart.finditer(text):
+        pos = m.start()
+        if m.group(1):
+            match(comment, pos)
+            continue
+        name = m.group(2) or m.group(4)
+        # Case-insensitive matching of non-ASCII names, e.g. the Kelvin sign
+        # matches 'k', is left to the patterns
+        known = name.isascii()
+        name = name.lower()
+        if m.group(2):
+            if known:
+                candidates = ignored_tag_index.get(name, [])
+            else:
+                candidates = ignored_tag_patterns
+            for left, right in candidates:
+                match(right, pos)
+            continue
+        if known:
+            if name in selfClosing_tag_index:
+                match(selfClosing_tag_index[name], pos)
+        else:
+            for pattern in selfClosing_tag_patterns:
+                match(pattern, pos)
+        if not m.group(3):  # no space between '<' and the name
+            if known:
+                candidates = ignored_tag_index.get(name, [])
+            else:
+                candidates = ignored_tag_patterns
+            for left, right in candidates:
+                match(left, pos)
+    return spans
 
 # Match HTML placeholder tags
 placeholder_tag_patterns = [
@@ -792,6 +1092,38 @@ placeholder_tag_patterns = [
      repl) for tag, repl in placeholder_tags.items()
 ]
 
+
+def expandPlaceholders(text, pattern, placeholder):
+    """
+    Replace the elements matching :param pattern: with :param placeholder:
+    numbered in order, elements of the same text with the first number,
+    in a single pass.
+    Elements used to be replaced one after the other in the whole text, which
+    also replaced the same text elsewhere. Outside of elements it would have
+    been matched as an element, inside one, e.g. '<math> <math>x</math>'
+    after '<math>x</math>', the text falls back to that.
+    """
+    found = list(pattern.finditer(text))
+    if not found:
+        return text
+    elements = set(m.group() for m in found)
+    for m in found:
+        pos = text.find('<', m.start() + 1, m.end())
+        while pos != -1:
+            inner = pattern.match(text, pos)
+            if inner and inner.group() in elements:
+                for index, element in enumerate(found, 1):
+                    text = text.replace(element.group(),
+                                        '%s_%d' % (placeholder, index))
+                return text
+            pos = text.find('<', pos + 1, m.end())
+
+    placeholders = {}
+    index = count(1)
+    return pattern.sub(lambda m: placeholders.setdefault(
+        m.group(), '%s_%d' % (placeholder, next(index))), text)
+
+
 # Match preformatted lines
 preformatted = re.compile(r'^ .*?$')
 
@@ -841,37 +1173,57 @@ class Extractor():
         """
         :param page: a list of lines.
         """
+        self.magicWords = MagicWords()
+        self.reset(id, revid, urlbase, title, page)
+
+    def reset(self, id, revid, urlbase, title, page):
+        """
+        Reuse the extractor for another article, only the state of the
+        article is reset.
+        :param page: a list of lines.
+        """
         self.id = id
         self.revid = revid
         self.url = get_url(urlbase, id)
         self.title = title
         self.page = page
-        self.magicWords = MagicWords()
+        self.magicWords['pagename'] = title
+        self.magicWords['fullpagename'] = title
         self.frame = []
         self.recursion_exceeded_1_errs = 0  # template recursion within expandTemplates()
         self.recursion_exceeded_2_errs = 0  # template recursion within expandTemplate()
         self.recursion_exceeded_3_errs = 0  # parameter recursion
         self.template_title_errs = 0
+        # Whether the current expansion read magic words or the frame
+        self.impure = False
+        # Deepest frame of the current expansion
+        self.deepest = 0
 
     def clean_text(self, text, mark_headers=False, expand_templates=False,
                    html_safe=True):
         """
         :param mark_headers: True to distinguish headers from paragraphs
           e.g. "## Section 1"
+        :return: paragraphs, links are HTML anchors
         """
-        self.magicWords['pagename'] = self.title
-        self.magicWords['fullpagename'] = self.title
-        self.magicWords['currentyear'] = time.strftime('%Y')
-        self.magicWords['currentmonth'] = time.strftime('%m')
-        self.magicWords['currentday'] = time.strftime('%d')
-        self.magicWords['currenthour'] = time.strftime('%H')
-        self.magicWords['currenttime'] = time.strftime('%H:%M:%S')
-
         text = clean(self, text, expand_templates=expand_templates,
                      html_safe=html_safe)
 
         text = compact(text, mark_headers=mark_headers)
-        return text
+        return [linksToHtml(x) for x in text]
+
+    def clean_text_links(self, text, mark_headers=False,
+                         expand_templates=False):
+        """
+        Same as clean_text(), without HTML markup of links.
+        :return: paragraphs joined by newlines, links in it, see
+          extractLinks()
+        """
+        text = clean(self, text, expand_templates=expand_templates,
+                     html_safe=False)
+
+        text = compact(text, mark_headers=mark_headers)
+        return extractLinks('\n'.join(text))
 
     def extract(self, out, html_safe=True):
         """
@@ -942,22 +1294,26 @@ class Extractor():
         # Test template expansion at:
         # https://en.wikipedia.org/wiki/Special:ExpandTemplates
 
-        res = ''
         if len(self.frame) >= self.maxTemplateRecursionLevels:
             self.recursion_exceeded_1_errs += 1
-            return res
+            self.impure = True  # depends on the depth of the frame
+            return ''
 
         # logging.debug('<expandTemplates ' + str(len(self.frame)))
 
+        # Pieces are joined once, the cost is linear in the number of
+        # invocations
+        res = []
         cur = 0
         # look for matching {{...}}
         for s, e in findMatchingBraces(wikitext, 2):
-            res += wikitext[cur:s] + self.expandTemplate(wikitext[s + 2:e - 2])
+            res.append(wikitext[cur:s])
+            res.append(self.expandTemplate(wikitext[s + 2:e - 2]))
             cur = e
         # leftover
-        res += wikitext[cur:]
+        res.append(wikitext[cur:])
         # logging.debug('   expandTemplates> %d %s', len(self.frame), res)
-        return res
+        return ''.join(res)
 
     def templateParams(self, parameters):
         """
@@ -1074,6 +1430,7 @@ class Extractor():
 
         if len(self.frame) >= self.maxTemplateRecursionLevels:
             self.recursion_exceeded_2_errs += 1
+            self.impure = True
             # logging.debug('   INVOCATION> %d %s', len(self.frame), body)
             return ''
 
@@ -1095,6 +1452,7 @@ class Extractor():
             subst = True
 
         if title.lower() in self.magicWords.values:
+            self.impure = True
             return self.magicWords[title.lower()]
 
         # Parser functions
@@ -1104,6 +1462,8 @@ class Extractor():
         if colon > 1:
             funct = title[:colon]
             parts[0] = title[colon + 1:].strip()  # side-effect (parts[0] not used later)
+            if funct == '#invoke':
+                self.impure = True  # reads parameters from the frame
             # arguments after first are not evaluated
             ret = callParserFunction(funct, parts, self.frame)
             return self.expandTemplates(ret)
@@ -1113,19 +1473,21 @@ class Extractor():
             self.template_title_errs += 1
             return ''
 
-        redirected = redirects.get(title)
-        if redirected:
-            title = redirected
-
         # get the template
-        if title in templateCache:
-            template = templateCache[title]
-        elif title in templates:
-            template = Template.parse(templates[title])
-            # add it to cache
-            templateCache[title] = template
-            del templates[title]
+        if templateStore is not None:
+            # Parsed once for the whole dump, redirects are resolved
+            template = templateStore.get(title)
         else:
+            redirected = redirects.get(title)
+            if redirected:
+                title = redirected
+            template = templateCache.get(title)
+            if template is None and title in templates:
+                template = Template.parse(templates[title])
+                # add it to cache
+                templateCache[title] = template
+                del templates[title]
+        if template is None:
             # The page being included could not be identified
             return ''
 
@@ -1170,19 +1532,197 @@ class Extractor():
         # build a dict of name-values for the parameter values
         params = self.templateParams(params)
 
+        # The same invocations recur in many pages, expansions that read
+        # neither magic words nor the frame are shared across pages
+        key = (title, subst, tuple(sorted(params.items())))
+        cached = expansionCache.get(
+            key, self.maxTemplateRecursionLevels - len(self.frame))
+        if cached is not None:
+            value, depth = cached
+            self.deepest = max(self.deepest, len(self.frame) + depth)
+            return value
+        impure, deepest = self.impure, self.deepest
+        self.impure = False
+        self.deepest = len(self.frame)
+
         # Perform parameter substitution
         # extend frame before subst, since there may be recursion in default
         # parameter value, e.g. {{OTRS|celebrative|date=April 2015}} in article
         # 21637542 in enwiki.
         self.frame.append((title, params))
+        self.deepest = max(self.deepest, len(self.frame))
         instantiated = template.subst(params, self)
         # logging.debug('instantiated %d %s', len(self.frame), instantiated)
         value = self.expandTemplates(instantiated)
         self.frame.pop()
+        if not self.impure:
+            expansionCache.put(key, value, self.deepest - len(self.frame))
+        self.impure |= impure
+        self.deepest = max(self.deepest, deepest)
         # logging.debug('   INVOCATION> %s %d %s', title, len(self.frame), value)
         return value
 
 
+# ----------------------------------------------------------------------
+# Templates
+
+
+class Template(list):
+    """
+    A Template is a list of TemplateText or TemplateArgs
+    """
+
+    @classmethod
+    def parse(cls, body):
+        tpl = Template()
+        # we must handle nesting, s.a.
+        # {{{1|{{PAGENAME}}}
+        # {{{italics|{{{italic}}}}
+        # {{#if:{{{{{#if:{{{nominee|}}}|nominee|candidate}}|}}}|
+        #
+        start = 0
+        for s, e in findMatchingBraces(body, 3):
+            tpl.append(TemplateText(body[start:s]))
+            tpl.append(TemplateArg.parse(body[s + 3:e - 3]))
+            start = e
+        tpl.append(TemplateText(body[start:]))  # leftover
+        return tpl
+
+    def subst(self, params, extractor, depth=0):
+        # We perform parameter substitutions recursively.
+        # We also limit the maximum number of iterations to avoid too long or
+        # even endless loops (in case of malformed input).
+
+        # :see: http://meta.wikimedia.org/wiki/Help:Expansion#Distinction_between_variables.2C_parser_functions.2C_and_templates
+        #
+        # Parameter values are assigned to parameters in two (?) passes.
+        # Therefore a parameter name in a template can depend on the value of
+        # another parameter of the same template, regardless of the order in
+        # which they are specified in the template call, for example, using
+        # Template:ppp containing "{{{{{{p}}}}}}", {{ppp|p=q|q=r}} and even
+        # {{ppp|q=r|p=q}} gives r, but using Template:tvvv containing
+        # "{{{{{{{{{p}}}}}}}}}", {{tvvv|p=q|q=r|r=s}} gives s.
+
+        if depth > extractor.maxParameterRecursionLevels:
+            extractor.recursion_exceeded_3_errs += 1
+            return ''
+
+        return ''.join([tpl.subst(params, extractor, depth) for tpl in self])
+
+    def __str__(self):
+        return ''.join([str(x) for x in self])
+
+
+class TemplateText(str):
+    """Fixed text of template"""
+
+    def subst(self, params, extractor, depth):
+        return self
+
+
+class TemplateArg():
+    """
+    parameter to a template.
+    Has a name and a default value, both of which are Templates.
+    """
+
+    def __init__(self, name, default=None):
+        self.name = name
+        self.default = default
+
+    @classmethod
+    def parse(cls, parameter):
+        """
+        :param parameter: the parts of a tplarg.
+        """
+        # the parameter name itself might contain templates, e.g.:
+        #   appointe{{#if:{{{appointer14|}}}|r|d}}14|
+        #   4|{{{{{subst|}}}CURRENTYEAR}}
+
+        # any parts in a tplarg after the first (the parameter default) are
+        # ignored, and an equals sign in the first part is treated as plain text.
+        parts = splitParts(parameter)
+        if len(parts) > 1:
+            # This parameter has a default value
+            return cls(Template.parse(parts[0]), Template.parse(parts[1]))
+        return cls(Template.parse(parts[0]))
+
+    def __str__(self):
+        if self.default:
+            return '{{{%s|%s}}}' % (self.name, self.default)
+        else:
+            return '{{{%s}}}' % self.name
+
+    def subst(self, params, extractor, depth):
+        """
+        Substitute value for this argument from dict :param params:
+        Use :param extractor: to evaluate expressions for name and default.
+        Limit substitution to the maximun :param depth:.
+        """
+        # the parameter name itself might contain templates, e.g.:
+        # appointe{{#if:{{{appointer14|}}}|r|d}}14|
+        paramName = self.name.subst(params, extractor, depth + 1)
+        paramName = extractor.expandTemplates(paramName)
+        res = ''
+        if paramName in params:
+            res = params[paramName]  # use parameter value specified in template invocation
+        elif self.default:  # use the default value
+            defaultValue = self.default.subst(params, extractor, depth + 1)
+            res = extractor.expandTemplates(defaultValue)
+        # logging.debug('subst arg %d %s -> %s' % (depth, paramName, res))
+        return res
+
+
+class ExpansionCache():
+    """
+    Memo of the expansions of pure templates, keyed by title and parameters,
+    with the depth of frame they need.
+    Least recently used expansions are evicted once the size of keys and
+    values exceeds :param max_size: characters.
+    """
+
+    def __init__(self, max_size=1 << 24):
+        self.max_size = max_size
+        self.clear()
+
+    def clear(self):
+        self._cache = OrderedDict()  # key -> (value, depth, size)
+        self.size = 0
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+
+    def __len__(self):
+        return len(self._cache)
+
+    def get(self, key, depth):
+        """:return: the expansion of :param key: and the depth of frame it
+        needs, None if not cached or if it needs more than :param depth:.
+        """
+        item = self._cache.get(key)
+        if item is None or item[1] >= depth:
+            self.misses += 1
+            return None
+        self.hits += 1
+        self._cache.move_to_end(key)
+        return item[:2]
+
+    def put(self, key, value, depth):
+        title, subst, params = key
+        size = len(value) + len(title) + sum(len(k) + len(v) for k, v in params)
+        if size > self.max_size // 16:
+            return  # would evict too many expansions
+        old = self._cache.pop(key, None)
+        if old is not None:
+            self.size -= old[2]
+        self._cache[key] = (value, depth, size)
+        self.size += size
+        while self.size > self.max_size:
+            _, (_, _, size) = self._cache.popitem(last=False)
+            self.size -= size
+            self.evictions += 1
+
+
 # ----------------------------------------------------------------------
 # parameter handling
 
@@ -1606,6 +2146,14 @@ def sharp_switch(primary, *params):
 
 
 # Extension Scribuntu
+# Lua modules are not run, these are replacements of their functions
+modules = {
+    'convert': {
+        'convert': lambda x, u, *rest: x + ' ' + u,  # no conversion
+    }
+}
+
+
 def sharp_invoke(module, function, frame):
     functions = modules.get(module)
     if functions:
@@ -1627,7 +2175,8 @@ def sharp_invoke(module, function, frame):
     return ''
 
 
-parserFunctions = {
+# Read-only, shared by all extractors
+parserFunctions = MappingProxyType({
 
     '#expr': sharp_expr,
 
@@ -1667,7 +2216,7 @@ parserFunctions = {
 
     'int': lambda string, *rest: str(int(string)),
 
-}
+})
 
 
 def callParserFunction(functionName, args, frame):
@@ -1685,8 +2234,9 @@ def callParserFunction(functionName, args, frame):
             ret = sharp_invoke(args[0].strip(), args[1].strip(), frame)
             # logging.debug('parserFunction> %s %s', functionName, ret)
             return ret
-        if functionName in parserFunctions:
-            ret = parserFunctions[functionName](*args)
+        funct = parserFunctions.get(functionName)
+        if funct is not None:
+            ret = funct(*args)
             # logging.debug('parserFunction> %s %s', functionName, ret)
             return ret
     except:
@@ -1707,6 +2257,11 @@ redirects = {}
 # cache of parser templates
 # FIXME: sharing this with a Manager slows down.
 templateCache = {}
+# Templates of a whole dump (common/templates.py), used instead of the above
+# if set. It is memory-mapped, hence shared by processes forked after it.
+templateStore = None
+# expansions of pure templates, one per process
+expansionCache = ExpansionCache()
 
 
 def define_template(title, page):
@@ -1745,9 +2300,9 @@ def define_template(title, page):
     text = re.sub(r'<noinclude\s*>.*$', '', text, flags=re.DOTALL)
     text = re.sub(r'<noinclude/>', '', text)
 
-    onlyincludeAccumulator = ''
-    for m in re.finditer('<onlyinclude>(.*?)</onlyinclude>', text, re.DOTALL):
-        onlyincludeAccumulator += m.group(1)
+    onlyincludeAccumulator = ''.join(
+        m.group(1) for m in
+        re.finditer('<onlyinclude>(.*?)</onlyinclude>', text, re.DOTALL))
     if onlyincludeAccumulator:
         text = onlyincludeAccumulator
     else:
@@ -0,0 +1,99 @@
+import os
+import hashlib
+import logging
+
+import ujson as json
+
+
+logger = logging.getLogger()
+
+
+def checksum(path):
+    md5 = hashlib.md5()
+    with open(path, 'rb') as f:
+        for data in iter(lambda: f.read(1 << 20), b''):
+            md5.update(data)
+    return {
+        'size': os.path.getsize(path),
+        'md5': md5.hexdigest()
+    }
+
+
+class Manifest():
+    """Completed blocks of a run.
+    The first line is the plan of the run, {'plan': [block]}, followed by one
+    JSON line per block, appended as soon as the block is completed:
+    {'block', 'records', 'files': {path relative to outdir: checksum}}
+    """
+
+    def __init__(self, path, resume=False, plan=None):
+        """:param plan: names of the blocks of the run, completed blocks of
+        another plan (e.g. another --chunk_size) are not resumed.
+        """
+        self.path = path
+        self.outdir = os.path.dirname(path)
+        self.plan = None if plan is None else set(plan)
+        self.done = {}
+        if resume and os.path.exists(path):
+            with open(path, 'r') as f:
+                for line in f:
+                    try:
+                        entry = json.loads(line)
+                    except ValueError:  # interrupted while writing
+                        continue
+                    if 'plan' in entry:
+                        continue
+                    if self.plan is not None and \
+                       entry['block'] not in self.plan:
+                        logger.warning(f'block out of the plan: '
+                                       f'{entry["block"]}')
+                        continue
+                    if self.verify(entry):
+                        self.done[entry['block']] = entry
+                    else:
+                        logger.warning(f'invalid block: {entry["block"]}')
+        # Keep verified blocks only
+        with open(path, 'w') as fw:
+            if self.plan is not None:
+                fw.write(f'{json.dumps({"plan": sorted(self.plan)})}\n')
+            for entry in self.done.values():
+                fw.write(f'{json.dumps(entry)}\n')
+
+    def __contains__(self, block):
+        return block in self.done
+
+    def __len__(self):
+        return len(self.done)
+
+    def verify(self, entry):
+        for path, expected in entry['files'].items():
+            path = f'{self.outdir}/{path}'
+            if not os.path.exists(path) or \
+               os.path.getsize(path) != expected['size'] or \
+               checksum(path) != expected:
+                return False
+        return True
+
+    def prune(self, dirs):
+        """Remove the files of blocks out of the plan from :param dirs:
+        (relative to outdir), left by runs planned otherwise.
+        :return: number of files removed
+        """
+        num_of_removed = 0
+        for d in dirs:
+            d = f'{self.outdir}/{d}'
+            if not os.path.isdir(d):
+                continue
+            for i in os.listdir(d):
+                if i.startswith('b_') and i.split('.')[0] not in self.plan:
+                    os.remove(f'{d}/{i}')
+                    num_of_removed += 1
+        return num_of_removed
+
+    def add(self, entry):
+        """Callback of a task, `entry` is None if the task failed."""
+        if entry is None:
+            return
+        self.done[entry['block']] = entry
+        with open(self.path, 'a') as fw:
+            fw.write(f'{json.dumps(entry)}\n')
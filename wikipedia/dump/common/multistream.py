@@ -0,0 +1,110 @@
+import bz2
+
+from lxml import etree
+
+from common.profiling import Profiler
+
+
+# Number of compressed bytes read from the dump at a time
+BUFSIZE = 1 << 20
+
+MEDIAWIKI_END = b'</mediawiki>'
+
+
+def read_streams(f, beg, end=-1, bufsize=BUFSIZE):
+    """Decompress the bz2 streams stored in bytes [beg, end) of a
+    multistream dump, one stream after another.
+    Yield decompressed bytes as soon as they are available, so that only
+    `bufsize` compressed bytes are held in memory at a time.
+    If `end` is -1, read until the end of file.
+    """
+    f.seek(beg)
+    remaining = None if end == -1 else end - beg
+    decompressor = bz2.BZ2Decompressor()
+    while remaining is None or remaining > 0:
+        if remaining is None:
+            data = f.read(bufsize)
+        else:
+            data = f.read(min(bufsize, remaining))
+            remaining -= len(data)
+        if not data:
+            break
+        while data:
+            if decompressor.eof:  # Beginning of the next stream
+                decompressor = bz2.BZ2Decompressor()
+            decompressed = decompressor.decompress(data)
+            if decompressed:
+                yield decompressed
+            data = decompressor.unused_data if decompressor.eof else b''
+    if not decompressor.eof:
+        raise EOFError('Compressed data ended before the end-of-stream marker '
+                       'was reached')
+
+
+def _read_pages(parser):
+    for _, elem in parser.read_events():
+        yield elem
+        # Free the page and the siblings parsed before it
+        elem.clear()
+        while elem.getprevious() is not None:
+            del elem.getparent()[0]
+
+
+def iter_pages(p_xml, beg, end=-1, bufsize=BUFSIZE, profiler=None):
+    """Incrementally parse the <page> elements stored in bytes [beg, end) of
+    pages-articles-multistream.xml.bz2.
+    Decompressed bytes are fed to lxml directly as they are produced, hence
+    memory usage is bounded by the size of one page rather than the range.
+    A page is cleared once the caller asks for the next one.
+    :param profiler: times `decompress` and `parse` stages if given
+    """
+    if profiler is None:
+        profiler = Profiler(enabled=False)
+    parser = etree.XMLPullParser(events=('end',), tag='page')
+    # Wrap up pages in a single root element
+    parser.feed(b'<pages>\n')
+    tail = b''
+    with open(p_xml, 'rb') as f:
+        streams = read_streams(f, beg, end, bufsize)
+        while True:
+            with profiler.stage('decompress'):
+                data = next(streams, None)
+            if data is None:
+                break
+            if end == -1:
+                # The last stream closes the <mediawiki> root element, drop
+                # it. Hold back a few bytes in case the tag is split across
+                # two reads.
+                data = (tail + data).replace(MEDIAWIKI_END, b'')
+                keep = len(MEDIAWIKI_END) - 1
+                tail, data = data[-keep:], data[:-keep]
+            with profiler.stage('parse'):
+                parser.feed(data)
+            yield from _read_pages(parser)
+    parser.feed(tail + b'</pages>\n')
+    yield from _read_pages(parser)
+    parser.close()
+
+
+def plan_chunks(offsets, file_size, chunk_size):
+    """Group consecutive bz2 streams into chunks of roughly `chunk_size`
+    compressed bytes, using the distances between stream offsets in the
+    multistream index.
+    :param offsets: sorted distinct stream offsets.
+    :param file_size: size of the dump, to measure the last stream.
+    :return: a list of (beg, end) pairs, largest chunk first, end is -1 for
+    the chunk reaching the end of file.
+    """
+    chunks = []
+    beg = offsets[0]
+    for offset in offsets[1:]:
+        if offset - beg >= chunk_size:
+            chunks.append((beg, offset))
+            beg = offset
+    chunks.append((beg, -1))
+
+    # Largest first, so that long chunks are not left to the end of the run
+    def size(chunk):
+        beg, end = chunk
+        return (file_size if end == -1 else end) - beg
+    return sorted(chunks, key=size, reverse=True)
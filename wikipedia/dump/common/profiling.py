@@ -0,0 +1,113 @@
+import os
+import time
+import logging
+import resource
+from collections import defaultdict
+from contextlib import contextmanager, nullcontext
+
+
+logger = logging.getLogger()
+
+# Stages of fast_iter(), in the order they are reported
+STAGES = ['decompress', 'parse', 'reuse', 'disambiguation', 'clean_text',
+          'replace_links', 'infobox', 'json']
+
+_NULL = nullcontext()
+
+
+class Profiler():
+    """Cumulative wall time of the stages of a block, in the process it is
+    processed by. Disabled profilers cost one attribute lookup per stage.
+    """
+
+    def __init__(self, enabled=True):
+        self.enabled = enabled
+        self.times = defaultdict(float)
+        self.pages = 0
+        self.bytes = 0  # compressed bytes
+        self.counts = defaultdict(int)  # e.g. hits of caches
+        self._start = time.perf_counter()
+
+    def stage(self, name):
+        if not self.enabled:
+            return _NULL
+        return self._stage(name)
+
+    @contextmanager
+    def _stage(self, name):
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.times[name] += time.perf_counter() - start
+
+    def stats(self):
+        return {
+            'pid': os.getpid(),
+            'time': time.perf_counter() - self._start,
+            'pages': self.pages,
+            'bytes': self.bytes,
+            'stages': dict(self.times),
+            'counts': dict(self.counts),
+            # Peak of the process so far, kilobytes on Linux
+            'max_rss_kb': resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+        }
+
+
+def aggregate(blocks, wall_time):
+    """Sum up the stats of blocks, :param wall_time: is the time the pool
+    took to process them.
+    """
+    res = {
+        'wall_time': wall_time,
+        'pages': 0,
+        'bytes': 0,
+        'time': 0,
+        'stages': defaultdict(float),
+        'counts': defaultdict(int),
+        'workers': {}
+    }
+    for stats in blocks:
+        res['pages'] += stats['pages']
+        res['bytes'] += stats['bytes']
+        res['time'] += stats['time']
+        for name, t in stats['stages'].items():
+            res['stages'][name] += t
+        for name, n in stats['counts'].items():
+            res['counts'][name] += n
+        worker = res['workers'].setdefault(
+            str(stats['pid']), {'blocks': 0, 'pages': 0, 'time': 0,
+                                'max_rss_kb': 0})
+        worker['blocks'] += 1
+        worker['pages'] += stats['pages']
+        worker['time'] += stats['time']
+        worker['max_rss_kb'] = max(worker['max_rss_kb'], stats['max_rss_kb'])
+    # Time of fast_iter() not spent in any stage
+    res['stages']['other'] = res['time'] - sum(res['stages'].values())
+    res['stages'] = dict(res['stages'])
+    res['counts'] = dict(res['counts'])
+    if wall_time > 0:
+        res['pages_per_sec'] = res['pages'] / wall_time
+        res['bytes_per_sec'] = res['bytes'] / wall_time
+    return res
+
+
+def report(summary):
+    wall_time = summary['wall_time'] or float('nan')
+    logger.info(f'profile: {summary["pages"]} pages, '
+                f'{summary["bytes"] / 1024 / 1024:.1f} MB in '
+                f'{wall_time:.1f}s, '
+                f'{summary["pages"] / wall_time:.1f} pages/s, '
+                f'{summary["bytes"] / 1024 / 1024 / wall_time:.2f} MB/s')
+    total = summary['time'] or float('nan')
+    for name in STAGES + ['other']:
+        t = summary['stages'].get(name, 0)
+        logger.info(f'profile: {name:<14}{t:10.2f}s {100 * t / total:5.1f}%')
+    for name, n in sorted(summary['counts'].items()):
+        logger.info(f'profile: {name:<24}{n:10d}')
+    for pid, worker in sorted(summary['workers'].items()):
+        logger.info(f'profile: worker {pid}: {worker["blocks"]} blocks, '
+                    f'{worker["pages"]} pages, {worker["time"]:.1f}s, '
+                    f'max RSS {worker["max_rss_kb"] / 1024:.0f} MB')
+    for name, t in summary.get('run', {}).items():
+        logger.info(f'profile: run {name:<10}{t:10.2f}s')
@@ -0,0 +1,132 @@
+import os
+import bisect
+import hashlib
+import logging
+from array import array
+
+import ujson as json
+
+
+logger = logging.getLogger()
+
+# Files of the previous run whose line offsets are cached, per process
+MAX_CACHED_FILES = 8
+
+
+def content_hash(title, text):
+    """Hash of what a record is extracted from, a moved page (same id and
+    text, new title) is a modified page.
+    """
+    return hashlib.sha1(f'{title}\n{text}'.encode('utf-8')).hexdigest()
+
+
+def _key(sha1):
+    # 64 bits are enough to detect the change of a page
+    return int(sha1[:16], 16)
+
+
+class Revisions():
+    """Page revisions of a finished run, read from the sidecars written
+    along with each block: line n of revisions/{block} is the `id`, `revid`,
+    `sha1` and link titles (before redirection) of line n of blocks/{block}.
+    Lookups by page id are binary searches over sorted arrays, records are
+    read back from the blocks of the run.
+    """
+
+    def __init__(self, outdir):
+        self.outdir = outdir
+        self.blocks = sorted(
+            os.listdir(f'{outdir}/revisions'),
+            key=lambda x: [int(i) for i in x[2:].split('-', 1)])
+        self.ids = array('Q')
+        self.sha1 = array('Q')
+        self._block = array('I')
+        self._line = array('I')
+        for n, block in enumerate(self.blocks):
+            with open(f'{outdir}/revisions/{block}', 'r') as f:
+                for i, line in enumerate(f):
+                    d = json.loads(line)
+                    self.ids.append(int(d['id']))
+                    self.sha1.append(_key(d['sha1']))
+                    self._block.append(n)
+                    self._line.append(i)
+        # Pages are in id order in dumps, sort only if they are not
+        if any(self.ids[i] > self.ids[i + 1] for i in range(len(self) - 1)):
+            order = sorted(range(len(self)), key=self.ids.__getitem__)
+            for name in ['ids', 'sha1', '_block', '_line']:
+                values = getattr(self, name)
+                setattr(self, name,
+                        array(values.typecode, (values[i] for i in order)))
+        self._cached = {}
+
+    def __len__(self):
+        return len(self.ids)
+
+    def find(self, page_id):
+        """:return: index of :param page_id:, -1 if not found."""
+        page_id = int(page_id)
+        i = bisect.bisect_left(self.ids, page_id)
+        if i < len(self.ids) and self.ids[i] == page_id:
+            return i
+        return -1
+
+    def unchanged(self, page_id, sha1):
+        i = self.find(page_id)
+        return i >= 0 and self.sha1[i] == _key(sha1)
+
+    def _offsets(self, path):
+        offsets = array('Q')
+        with open(path, 'rb') as f:
+            pos = 0
+            for line in f:
+                offsets.append(pos)
+                pos += len(line)
+        return offsets
+
+    def _readline(self, path, i):
+        """Read line :param i: of :param path:, line offsets of the most
+        recently used files are cached.
+        """
+        if path not in self._cached:
+            if len(self._cached) >= MAX_CACHED_FILES:
+                self._cached.pop(next(iter(self._cached)))
+            self._cached[path] = self._offsets(path)
+        with open(path, 'rb') as f:
+            f.seek(self._cached[path][i])
+            return json.loads(f.readline())
+
+    def record(self, page_id):
+        """Read back the record of :param page_id:, with links titled as
+        before redirection.
+        """
+        i = self.find(page_id)
+        block = self.blocks[self._block[i]]
+        res = self._readline(f'{self.outdir}/blocks/{block}', self._line[i])
+        rev = self._readline(f'{self.outdir}/revisions/{block}',
+                             self._line[i])
+        for link, title in zip(res.get('links', ()), rev['links']):
+            link.pop('ref', None)
+            link.pop('id', None)
+            link['title'] = title
+        return res
+
+    def delta(self, other):
+        """Compare with the revisions of an earlier run.
+        :return: ids of added, removed and modified pages
+        """
+        added, removed, modified = [], [], []
+        i, j = 0, 0
+        while i < len(self) or j < len(other):
+            if j == len(other) or \
+               (i < len(self) and self.ids[i] < other.ids[j]):
+                added.append(str(self.ids[i]))
+                i += 1
+            elif i == len(self) or self.ids[i] > other.ids[j]:
+                removed.append(str(other.ids[j]))
+                j += 1
+            else:
+                if self.sha1[i] != other.sha1[j]:
+                    modified.append(str(self.ids[i]))
+                i += 1
+                j += 1
+        return added, removed, modified
@@ -0,0 +1,251 @@
+import os
+import re
+import bz2
+import mmap
+import struct
+import logging
+import multiprocessing
+from array import array
+from collections import OrderedDict
+
+import ujson as json
+
+from common import extract
+from common.extract import Template, TemplateArg, TemplateText
+from common.extract import define_template
+from common.multistream import iter_pages
+
+
+logger = logging.getLogger()
+
+MAGIC = b'WKTPL001'
+# magic, # of titles, namespace size, title blob size
+HEADER = struct.Struct('<8sQQQ')
+
+TEMPLATE_NS = '10'
+
+# Number of bz2 streams scanned by each task
+STREAMS_PER_TASK = 64
+
+# Parsed templates kept per process
+MAX_CACHED_TEMPLATES = 4096
+
+
+def read_namespace(p_xml, end, key=TEMPLATE_NS):
+    """:return: name of namespace :param key: in the <siteinfo> header,
+    which is the first stream of the dump, ending at :param end:.
+    """
+    with open(p_xml, 'rb') as f:
+        header = bz2.decompress(f.read(end)).decode('utf-8')
+    m = re.search(rf'<namespace key="{key}"[^>]*>([^<]*)</namespace>', header)
+    if m is None:
+        return 'Template'
+    return m.group(1)
+
+
+def dump_template(template):
+    """Serialize a parsed template, text is a string, an argument is a list
+    of its name and default.
+    """
+    return [x if isinstance(x, TemplateText) else
+            [dump_template(x.name),
+             None if x.default is None else dump_template(x.default)]
+            for x in template]
+
+
+def load_template(data):
+    template = Template()
+    for x in data:
+        if isinstance(x, str):
+            template.append(TemplateText(x))
+        else:
+            name, default = x
+            template.append(TemplateArg(
+                load_template(name),
+                None if default is None else load_template(default)))
+    return template
+
+
+def scan_streams(p_xml, streams):
+    """Parse the templates of :param streams:, (beg, end) pairs.
+    :return: {title: serialized template}, {title: redirect target}
+    """
+    redirects = {}
+    # define_template() adds to the globals of the process
+    extract.templates.clear()
+    for beg, end in streams:
+        for elem in iter_pages(p_xml, beg, end):
+            if elem.find('ns').text != TEMPLATE_NS:
+                continue
+            title = elem.find('title').text
+            if elem.find('redirect') is not None:
+                redirects[title] = elem.find('redirect').attrib['title']
+                continue
+            text = elem.find('revision').find('text').text or ''
+            define_template(title, [text])
+    res = {title: json.dumps(dump_template(Template.parse(text)))
+           for title, text in extract.templates.items()}
+    extract.templates.clear()
+    return res, redirects
+
+
+def build_template_store(p_xml, index, p_store, nworker=1):
+    """Pre-scan the Template namespace of a dump into a binary file.
+    Only the streams holding templates, found by title in :param index:
+    (DumpIndex), are decompressed.
+
+    Layout, arrays are unsigned 64-bit integers in native byte order:
+      header
+      title_pos[# of titles+1] position of the i-th title in the title blob
+      data_beg[# of titles]    position of the i-th template in the data blob
+      data_end[# of titles]
+      namespace                utf-8 name of the Template namespace
+      title blob               utf-8 titles, sorted
+      data blob                serialized templates (JSON), redirects share
+                               the template they redirect to
+    """
+    namespace = read_namespace(p_xml, index.streams[0])
+    streams = [(x, index.stream_end(x))
+               for x in index.find_by_prefix(f'{namespace}:')]
+    logger.info(f'# of template streams: {len(streams)}')
+    tasks = [(p_xml, streams[i:i + STREAMS_PER_TASK])
+             for i in range(0, len(streams), STREAMS_PER_TASK)]
+    templates, redirects = {}, {}
+    pool = multiprocessing.Pool(processes=nworker)
+    for t, r in pool.starmap(scan_streams, tasks):
+        templates.update(t)
+        redirects.update(r)
+    pool.close()
+    pool.join()
+    # Redirects share the template they redirect to
+    targets = {x: x for x in templates}
+    for title, target in redirects.items():
+        if target in templates:
+            targets.setdefault(title, target)
+    logger.info(f'# of templates: {len(templates)}, '
+                f'redirects: {len(targets) - len(templates)}')
+
+    titles = sorted(targets)
+    title_pos = array('Q', [0])
+    for title in titles:
+        title_pos.append(title_pos[-1] + len(title.encode('utf-8')))
+    data = bytearray()
+    positions = {}  # title of a template -> (beg, end) in data
+    data_beg, data_end = array('Q'), array('Q')
+    for title in titles:
+        target = targets[title]
+        if target not in positions:
+            beg = len(data)
+            data += templates[target].encode('utf-8')
+            positions[target] = (beg, len(data))
+        beg, end = positions[target]
+        data_beg.append(beg)
+        data_end.append(end)
+    namespace = namespace.encode('utf-8')
+
+    tmp = f'{p_store}.tmp'
+    with open(tmp, 'wb') as fw:
+        fw.write(HEADER.pack(MAGIC, len(titles), len(namespace),
+                             title_pos[-1]))
+        title_pos.tofile(fw)
+        data_beg.tofile(fw)
+        data_end.tofile(fw)
+        fw.write(namespace)
+        fw.write(''.join(titles).encode('utf-8'))
+        fw.write(data)
+    os.replace(tmp, p_store)
+
+
+class TemplateStore():
+    """Memory-mapped templates of a dump, parsed once by
+    build_template_store(). Created before the pool, hence the mapping is
+    shared by the workers, each keeping the most recently used templates
+    parsed. Lookups by title are binary searches.
+    """
+
+    def __init__(self, p_store, cache_size=MAX_CACHED_TEMPLATES):
+        with open(p_store, 'rb') as f:
+            self._mm = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+        magic, n, namespace_size, titles_size = HEADER.unpack_from(self._mm)
+        if magic != MAGIC:
+            raise ValueError(f'Not a template store: {p_store}')
+        self._n = n
+        view = memoryview(self._mm)
+        pos = HEADER.size
+
+        def take(size):
+            nonlocal pos
+            res = view[pos:pos + 8 * size].cast('Q')
+            pos += 8 * size
+            return res
+        self._title_pos = take(n + 1)
+        self._data_beg = take(n)
+        self._data_end = take(n)
+        self.namespace = self._mm[pos:pos + namespace_size].decode('utf-8')
+        self._titles = pos + namespace_size
+        self._data = self._titles + titles_size
+        self.cache_size = cache_size
+        self._cached = OrderedDict()
+
+    @classmethod
+    def load(cls, p_xml, index, p_store=None, nworker=1):
+        """Open the store of :param p_xml:, build it if it is missing or
+        older than the dump.
+        """
+        if p_store is None:
+            p_store = f'{p_xml}.templates'
+        if not os.path.exists(p_store) or \
+           os.path.getmtime(p_store) < os.path.getmtime(p_xml):
+            logger.info(f'building template store: {p_store}')
+            build_template_store(p_xml, index, p_store, nworker)
+        return cls(p_store)
+
+    def __len__(self):
+        return self._n
+
+    def _title(self, rank):
+        beg = self._titles + self._title_pos[rank]
+        end = self._titles + self._title_pos[rank + 1]
+        return self._mm[beg:end]
+
+    def rank(self, title):
+        """:return: rank of :param title:, -1 if not found."""
+        title = title.encode('utf-8')
+        lo, hi = 0, self._n
+        while lo < hi:
+            mid = (lo + hi) // 2
+            if self._title(mid) < title:
+                lo = mid + 1
+            else:
+                hi = mid
+        if lo < self._n and self._title(lo) == title:
+            return lo
+        return -1
+
+    def __contains__(self, title):
+        return title in self._cached or self.rank(title) >= 0
+
+    def get(self, title):
+        """:return: parsed template :param title:, None if not found."""
+        template = self._cached.get(title)
+        if template is not None:
+            self._cached.move_to_end(title)
+            return template
+        rank = self.rank(title)
+        if rank < 0:
+            return None
+        beg = self._data + self._data_beg[rank]
+        end = self._data + self._data_end[rank]
+        template = load_template(json.loads(self._mm[beg:end]))
+        self._cached[title] = template
+        if len(self._cached) > self.cache_size:
+            self._cached.popitem(last=False)
+        return template
+
+
+def use_templates(store):
+    """Expand the templates of :param store: in Extractor.clean_text()."""
+    extract.templateStore = store
+    extract.templateNamespace = store.namespace
+    extract.templatePrefix = f'{store.namespace}:'
+    extract.knownNamespaces.add(store.namespace)
@@ -0,0 +1,59 @@
+from array import array
+
+
+class TitleTable():
+    """Compact table of page titles, sorted in code point order.
+    Titles are stored in a single utf-8 buffer, page ids, redirect targets
+    and disambiguation flags in arrays indexed by the rank of the title.
+    Lookups by title are binary searches.
+    """
+
+    def __init__(self):
+        self._blob = bytearray()
+        self._pos = array('Q', [0])
+        self.ids = array('Q')
+        self.redirects = array('q')  # rank of the target, -1 if not redirect
+        self.disambiguation = bytearray()
+
+    def __len__(self):
+        return len(self.ids)
+
+    def append(self, title, page_id, disambiguation=False):
+        """Titles must be appended in sorted order."""
+        self._blob += title.encode('utf-8')
+        self._pos.append(len(self._blob))
+        self.ids.append(int(page_id))
+        self.redirects.append(-1)
+        self.disambiguation.append(int(disambiguation))
+
+    def _title(self, rank):
+        return self._blob[self._pos[rank]:self._pos[rank + 1]]
+
+    def title(self, rank):
+        return self._title(rank).decode('utf-8')
+
+    def rank(self, title):
+        """:return: rank of :param title:, -1 if not found."""
+        title = title.encode('utf-8')
+        lo, hi = 0, len(self.ids)
+        while lo < hi:
+            mid = (lo + hi) // 2
+            if self._title(mid) < title:
+                lo = mid + 1
+            else:
+                hi = mid
+        if lo < len(self.ids) and self._title(lo) == title:
+            return lo
+        return -1
+
+    def resolve(self, title):
+        """Follow redirect of :param title:.
+        :return: (title, page id), page id is None if title is not found.
+        """
+        rank = self.rank(title)
+        if rank < 0:
+            return title, None
+        if self.redirects[rank] >= 0:
+            rank = self.redirects[rank]
+            title = self.title(rank)
+        return title, str(self.ids[rank])
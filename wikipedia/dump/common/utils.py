@@ -5,6 +5,12 @@ RE_LINK = re.compile(r'<a href="(.*?)" type="(\w+)">(.*?)</a>')
 RE_P14 = re.compile(r'\[\[Category:[^][]*\]\]', re.UNICODE)
 RE_CAT = re.compile(r'\[\[Category:([^\|\]]+)', re.UNICODE)
 RE_SEC = re.compile(r'(==+)\s*(.*?)\s*\1')
+RE_INFOBOX = re.compile(r'{{infobox', re.I)
+RE_BRACE = re.compile(r'[{}]')
+RE_INFOBOX_DELIM = re.compile(r'[{}|]|\[\[|\]\]')
+
+# Number of characters scanned for the end of an infobox
+INFOBOX_WINDOW = 1 << 18
 
 
 def is_in_range(x, y):
@@ -24,22 +30,17 @@ def normalize_wiki_title(s):
     return s
 
 
-def replace_links(text, shift=0):
+def link_records(text, spans):
+    """Links of :param text: as records, internal and external links apart.
+    :param spans: (start, end, target, type) of links, see
+      Extractor.clean_text_links()
+    """
     internal_links, external_links = [], []
-    for i in re.finditer(RE_LINK, text):
-        a_target, a_type, a_text = i.group(1), i.group(2), i.group(3)
-        if not a_target:
-            continue
-        if not a_text:
-            a_text = a_target
-        text = text[:i.start() - shift] + a_text + text[i.end() - shift:]
-        beg = i.start() - shift
-        shift += len(i.group()) - len(a_text)
-
+    for beg, end, a_target, a_type in spans:
         link = {
-            'text': a_text,
+            'text': text[beg:end],
             'start': beg,
-            'end': beg + len(a_text)
+            'end': end
         }
         if a_type == 'internal':
             link['title'] = normalize_wiki_title(a_target)
@@ -49,12 +50,31 @@ def replace_links(text, shift=0):
             external_links.append(link)
         else:
             raise Exception(f'Unrecognized anchor type: {a_type}')
+    return internal_links, external_links
 
-    for i in internal_links + external_links:
-        if text[i['start']:i['end']] != i['text']:
-            raise Exception('Unmatched link offset')
 
-    return text, internal_links, external_links
+def replace_links(text):
+    """Replace the HTML anchors of :param text: with their text.
+    :return: the text, internal and external links, see link_records()
+    """
+    res, spans = [], []
+    pos = 0  # length of the result so far
+    cur = 0
+    for i in re.finditer(RE_LINK, text):
+        a_target, a_type, a_text = i.group(1), i.group(2), i.group(3)
+        if not a_target:
+            continue
+        if not a_text:
+            a_text = a_target
+        res.append(text[cur:i.start()])
+        pos += i.start() - cur
+        spans.append((pos, pos + len(a_text), a_target, a_type))
+        res.append(a_text)
+        pos += len(a_text)
+        cur = i.end()
+    res.append(text[cur:])
+    text = ''.join(res)
+    return (text, *link_records(text, spans))
 
 
 def extract_categories(text):
@@ -81,18 +101,60 @@ def extract_sections(text):
     return sects
 
 
-def extract_infobox(text):
-    m = re.search('{{infobox', text, re.I)
-    if m:
-        result = ''
-        left = 0
-        right = 0
-        for c in text[m.start():]:
-            if c == '{':
-                left += 1
-            elif c == '}':
-                right += 1
-            result += c
-            if left == right:
-                return result
-    return None
\ No newline at end of file
+def extract_infobox(text, parse=False, window=INFOBOX_WINDOW):
+    """The first {{infobox ...}} of :param text:, up to its balancing
+    braces.
+    Only braces, pipes and brackets are visited, at most :param window:
+    characters after the beginning of the infobox.
+    :param parse: also split the infobox into a dict of its parameters,
+      unnamed ones are numbered from 1
+    :return: the infobox, None if it is unbalanced within the window; with
+      :param parse:, the infobox and its parameters, (None, None) if not
+      found
+    """
+    m = RE_INFOBOX.search(text)
+    if m is None:
+        return (None, None) if parse else None
+    beg = m.start()
+    end = len(text) if window is None else min(len(text), beg + window)
+    depth = 0  # of braces
+    brackets = 0  # depth of [[...]], pipes in links are not separators
+    parts = []
+    cur = beg + 2
+    for i in (RE_INFOBOX_DELIM if parse else RE_BRACE).finditer(text, beg,
+                                                                 end):
+        c = i.group()
+        if c == '{':
+            depth += 1
+        elif c == '}':
+            depth -= 1
+            if depth == 1:
+                close = i.start()
+            elif depth == 0:
+                result = text[beg:i.end()]
+                if not parse:
+                    return result
+                parts.append(text[cur:close])
+                return result, infobox_params(parts)
+        elif c == '[[':
+            brackets += 1
+        elif c == ']]':
+            brackets = max(brackets - 1, 0)
+        elif depth == 2 and not brackets:  # '|' of the infobox itself
+            parts.append(text[cur:i.start()])
+            cur = i.end()
+    return (None, None) if parse else None
+
+
+def infobox_params(parts):
+    """:param parts: the name of an infobox and its parameters"""
+    params = {}
+    n = 0
+    for part in parts[1:]:
+        key, eq, value = part.partition('=')
+        if eq:
+            params[key.strip()] = value.strip()
+        else:
+            n += 1
+            params[str(n)] = part.strip()
+    return params
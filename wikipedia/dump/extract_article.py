@@ -0,0 +1,71 @@
+import sys
+import argparse
+import logging
+
+import ujson as json
+
+from common.dumpindex import DumpIndex
+from common.multistream import iter_pages
+from common.disambiguation import Disambiguation
+from parse_pages_articles_multistream import parse_page, dump_lang
+
+
+logger = logging.getLogger()
+logging.basicConfig(format='%(asctime)s: %(levelname)s: %(message)s')
+logging.root.setLevel(level=logging.INFO)
+
+
+def extract_article(p_xml, index, title=None, page_id=None, lang=None):
+    """Extract a single page from the multistream dump, only the bz2 stream
+    containing the page is decompressed.
+    :param index: a DumpIndex of the dump.
+    :param lang: language code of the wiki (default=from the name of
+      :param p_xml:, as parse_pages_articles_multistream.py does)
+    :return: the record produced by parse_page(), None if not found.
+    """
+    if lang is None:
+        lang = dump_lang(p_xml)
+    if title is not None:
+        entry = index.find_by_title(title)
+    else:
+        entry = index.find_by_id(page_id)
+    if entry is None:
+        return None
+
+    beg, page_id, _ = entry
+    end = index.stream_end(beg)
+    for elem in iter_pages(p_xml, beg, end):
+        if elem.find('id').text == str(page_id):
+            return parse_page(elem, disambiguation=Disambiguation(lang))
+    return None
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser()
+    parser.add_argument('p_xml',
+                        help='path to pages-articles-multistream.xml.bz')
+    parser.add_argument('p_index',
+                        help='path to pages-articles-multistream-index.txt.bz2')
+    parser.add_argument('pages', nargs='+',
+                        help='titles (or page ids with --id) of the pages')
+    parser.add_argument('--id', default=False, action='store_true',
+                        help='pages are given by page ids')
+    parser.add_argument('--lang', default=None,
+                        help='language code of the wiki, for the templates '
+                        'of disambiguation pages (default=from the name of '
+                        'p_xml, e.g. en for enwiki-*, English templates if '
+                        'unknown)')
+    args = parser.parse_args()
+
+    index = DumpIndex.load(args.p_index)
+    for page in args.pages:
+        if args.id:
+            res = extract_article(args.p_xml, index, page_id=page,
+                                  lang=args.lang)
+        else:
+            res = extract_article(args.p_xml, index, title=page,
+                                  lang=args.lang)
+        if res is None:
+            logger.warning(f'page not found: {page}')
+            continue
+        sys.stdout.write(f'{json.dumps(res)}\n')
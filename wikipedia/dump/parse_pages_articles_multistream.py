@@ -3,18 +3,32 @@ import os
 import io
 import re
 import bz2
+import time
+import heapq
 import argparse
 import logging
+import tempfile
 import multiprocessing
 import subprocess
+from concurrent.futures import ProcessPoolExecutor, as_completed
+from concurrent.futures.process import BrokenProcessPool
 
 from lxml import etree
 from xml.etree.cElementTree import iterparse, dump
 import ujson as json
 
+from common import extract
 from common import wikimarkup
+from common.disambiguation import Disambiguation
+from common.dumpindex import DumpIndex
+from common.manifest import Manifest, checksum
 from common.extract import Extractor
-from common.utils import replace_links
+from common.multistream import iter_pages, plan_chunks
+from common.profiling import Profiler, aggregate, report
+from common.revisions import Revisions, content_hash
+from common.templates import TemplateStore, use_templates
+from common.titles import TitleTable
+from common.utils import link_records
 from common.utils import extract_sections, extract_categories, extract_infobox
 
 
@@ -23,111 +37,273 @@ logger = logging.getLogger()
 logging.basicConfig(format='%(asctime)s: %(levelname)s: %(message)s')
 logging.root.setLevel(level=logging.INFO)
 
-disambiguation_page_patterns = [
-    re.compile(r'({{disambiguation.*?}})', re.I),
-    re.compile(r'({{.*?disambiguation}})', re.I),
-    re.compile(r'({{hndis.*?}})', re.I)
-]
+LIGHT_FIELDS = ['id', 'title', 'redirect', 'disambiguation']
+
+# Fields of full records that can be selected with --fields
+FIELDS = ['article', 'links', 'external_links', 'sections', 'categories',
+          'infobox']
+
+# Fields extracted from the cleaned text
+TEXT_FIELDS = {'article', 'links', 'external_links', 'sections'}
+
+# Maximum number of sorted runs merged at once
+MERGE_FANIN = 256
+
+# TitleTable built by merge_output(), shared with workers
+title_table = None
+
+# Revisions of the previous run in incremental mode, shared with workers
+previous = None
+
+
+def dump_lang(p_xml):
+    """:return: language code of the wiki of the dump :param p_xml:, e.g. en
+    for enwiki-*, None if unknown.
+    """
+    m = re.match(r'(\w+?)wiki-', os.path.basename(p_xml))
+    if m is None:
+        return None
+    return m.group(1).replace('_', '-')
+
+
+def parse_page(elem, profiler=None, expand_templates=False, extractor=None,
+               fields=None, disambiguation=None):
+    """Extract a JSON record from a <page> element.
+    :param expand_templates: expand templates instead of dropping them, see
+      common/templates.py
+    :param extractor: Extractor reused from page to page, if given
+    :param fields: fields of the record besides LIGHT_FIELDS (default=all
+      of FIELDS), steps extracting other fields are skipped
+    :param disambiguation: Disambiguation of the language of the dump, see
+      dump_lang(), English templates if None
+    """
+    if profiler is None:
+        profiler = Profiler(enabled=False)
+    if fields is None:
+        fields = FIELDS
+    if disambiguation is None:
+        disambiguation = Disambiguation()
+    res = {
+        'id': elem.find('id').text,
+        'title': elem.find('title').text
+    }
+
+    raw_markup = elem.find('revision').find('text').text
+    if raw_markup is None:
+        raw_markup = ''
+
+    # Redirect
+    if elem.find('redirect') is not None:
+        res['redirect'] = elem.find('redirect').attrib['title']
+    else:
+        res['redirect'] = None
 
+    # Disambiguation
+    # https://en.wikipedia.org/wiki/Template:Disambiguation
+    with profiler.stage('disambiguation'):
+        res['disambiguation'] = disambiguation(raw_markup, res['redirect'])
 
-def fast_iter(beg, end, p_xml, outpath):
-    # Using index to seek bz2
-    bz2f = io.open(p_xml, 'rb')
-    bz2f.seek(beg)
-    if end == -1:
-        blocks = bz2f.read(-1)
-    else:
-        blocks = bz2f.read(end - beg)
-
-    # Convert bytes to str, and wrap up XML string
-    decompressed_blocks = bz2.decompress(blocks).decode('utf-8')
-    pages = f'<pages>\n{decompressed_blocks}</pages>\n'
-    if end == -1:
-        pages = pages.replace('</mediawiki>', '')
-    pages = pages.encode('utf-8')  # Convert str back to bytes
-
-    with open(f'{outpath}.full.tmp', 'w') as fw, \
-         open(f'{outpath}.light.tmp', 'w') as fw_light:
-        elems = etree.iterparse(io.BytesIO(pages), events=('end',), tag='page')
-        for _, elem in elems:
+    # Article
+    # text_with_links = wikimarkup.remove_markup(raw_markup)
+    # plain_text, links = wikimarkup.extract_links(text_with_links)
+
+    if TEXT_FIELDS.intersection(fields):
+        with profiler.stage('clean_text'):
+            if extractor is None:
+                extractor = Extractor(res['id'], 0, '', res['title'], [])
+            else:
+                extractor.reset(res['id'], 0, '', res['title'], [])
+            # Links are spans of the text, no HTML markup to parse back
+            plain_text, spans = extractor.clean_text_links(
+                raw_markup, mark_headers=True,
+                expand_templates=expand_templates)
+    if 'links' in fields or 'external_links' in fields:
+        with profiler.stage('replace_links'):
+            links, elinks = link_records(plain_text, spans)
+    # if len(links) != len(links_) or \
+    # set(([x['title'] for x in links])) != set(([x['title'] for x in links_])):
+    #     with open('tmp/foo/%s_a' % res['title'], 'w') as fwt:
+    #         fwt.write(str([x['title'] for x in links])+'\n\n')
+    #         fwt.write('\n'.join([x for x in text_with_links.split('\n') if x])+'\n\n')
+    #     with open('tmp/foo/%s_b' % res['title'], 'w') as fwt:
+    #         fwt.write(str([x['title'] for x in links_])+'\n\n')
+    #         fwt.write('\n'.join(paragraphs)+'\n\n')
+
+    # Sections
+    if 'sections' in fields:
+        res['sections'] = extract_sections(plain_text)
+
+    # Categories
+    if 'categories' in fields:
+        res['categories'] = extract_categories(raw_markup)
+
+    # Infobox
+    if 'infobox' in fields:
+        with profiler.stage('infobox'):
+            res['infobox'] = extract_infobox(raw_markup)
+
+    if 'article' in fields:
+        res['article'] = plain_text
+    if 'links' in fields:
+        res['links'] = links
+    if 'external_links' in fields:
+        res['external_links'] = elinks
+    return res
+
+
+def fast_iter(beg, end, p_xml, outpath, p_revisions, p_links=None,
+              profiler=None, expand_templates=False, fields=None,
+              side_outputs=None, lang=None):
+    """
+    :param p_revisions: the `id`, `revid`, `sha1` and link titles of each
+      article are written to it, one line per line of the full dump
+    :param p_links: if set, write articles to their final location at once,
+      with links referring to the link table of the block (`ref`). The table
+      is written to :param p_links:, and is resolved after merging, see
+      function: resolve_link_table()
+    :param profiler: times the stages of the block if given
+    :param expand_templates: see parse_page()
+    :param fields: fields of the articles, see parse_page()
+    :param side_outputs: {field: path}, the `id`, `title` and field of each
+      article are also written to path, whether the field is in
+      :param fields: or not
+    :param lang: language code of the wiki, see Disambiguation
+    :return: number of articles, number of articles reused from the
+      previous run
+    """
+    if profiler is None:
+        profiler = Profiler(enabled=False)
+    if fields is None:
+        fields = FIELDS
+    if side_outputs is None:
+        side_outputs = {}
+    kept = set(LIGHT_FIELDS).union(fields)
+    extracted = [x for x in FIELDS if x in fields or x in side_outputs]
+    disambiguation = Disambiguation(lang)
+    refs = {}  # title -> index in the link table
+    cache = extract.expansionCache
+    hits, misses, evictions = cache.hits, cache.misses, cache.evictions
+    extractor = Extractor('', 0, '', '', [])
+    num_of_articles = 0
+    num_of_reused = 0
+    full_path = f'{outpath}.full.tmp' if p_links is None else outpath
+    fw_side = {x: open(path, 'w') for x, path in side_outputs.items()}
+    with open(full_path, 'w') as fw, \
+         open(f'{outpath}.light.tmp', 'w') as fw_light, \
+         open(p_revisions, 'w') as fw_revisions:
+        # Using index to seek bz2, pages are decompressed and parsed
+        # incrementally
+        for elem in iter_pages(p_xml, beg, end, profiler=profiler):
             ns = elem.find('ns').text
             if ns != '0':  # Main page (ns == 0) only
                 continue
 
-            res = {
-                'id': elem.find('id').text,
-                'title': elem.find('title').text
+            page_id = elem.find('id').text
+            revision = elem.find('revision')
+            sha1 = content_hash(elem.find('title').text,
+                                revision.find('text').text or '')
+            res = None
+            if previous is not None and previous.unchanged(page_id, sha1):
+                with profiler.stage('reuse'):
+                    res = previous.record(page_id)
+                # The previous run may have extracted fewer fields
+                if all(x in res for x in extracted):
+                    num_of_reused += 1
+                else:
+                    res = None
+            if res is None:
+                res = parse_page(elem, profiler, expand_templates,
+                                 extractor, extracted, disambiguation)
+            num_of_articles += 1
+            rev = {
+                'id': page_id,
+                'revid': revision.find('id').text,
+                'sha1': sha1,
+                # Redirect targets may change in later dumps
+                'links': [x['title'] for x in res.get('links', ())]
             }
 
-            raw_markup = elem.find('revision').find('text').text
-            if raw_markup is None:
-                raw_markup = ''
-
-            # Redirect
-            if elem.find('redirect') is not None:
-                res['redirect'] = elem.find('redirect').attrib['title']
-            else:
-                res['redirect'] = None
-
-            # Disambiguation
-            # https://en.wikipedia.org/wiki/Template:Disambiguation
-            res['disambiguation'] = False
-            for dp in disambiguation_page_patterns:
-                if re.search(dp, raw_markup) and not res['redirect']:
-                    res['disambiguation'] = True
-                    break
-
             # Light JSON dump only contains:
             # `id`, `title`, `redirect`, `disambiguation`.
             # It is used for redirection, see function: merge_output()
-            fw_light.write(f'{json.dumps(res)}\n')
-
-            # Article
-            # text_with_links = wikimarkup.remove_markup(raw_markup)
-            # plain_text, links = wikimarkup.extract_links(text_with_links)
-
-            extractor = Extractor(res['id'], 0, '', res['title'], [])
-            paragraphs = extractor.clean_text(raw_markup,
-                                              mark_headers=True,
-                                              expand_templates=False,
-                                              html_safe=False)
-            plain_text, links, elinks = replace_links('\n'.join(paragraphs))
-            # if len(links) != len(links_) or \
-            # set(([x['title'] for x in links])) != set(([x['title'] for x in links_])):
-            #     with open('tmp/foo/%s_a' % res['title'], 'w') as fwt:
-            #         fwt.write(str([x['title'] for x in links])+'\n\n')
-            #         fwt.write('\n'.join([x for x in text_with_links.split('\n') if x])+'\n\n')
-            #     with open('tmp/foo/%s_b' % res['title'], 'w') as fwt:
-            #         fwt.write(str([x['title'] for x in links_])+'\n\n')
-            #         fwt.write('\n'.join(paragraphs)+'\n\n')
-
-            # Sections
-            res['sections'] = extract_sections(plain_text)
-
-            # Categories
-            res['categories'] = extract_categories(raw_markup)
-
-            # Infobox
-            res['infobox'] = extract_infobox(raw_markup)
+            light = {k: res[k] for k in LIGHT_FIELDS}
 
-            # Full dumps
-            res['article'] = plain_text
-            res['links'] = links
-            res['external_links'] = elinks
-            fw.write(f'{json.dumps(res)}\n')
+            with profiler.stage('json'):
+                for x, fw_x in fw_side.items():
+                    side = {'id': res['id'], 'title': res['title'],
+                            x: res[x]}
+                    fw_x.write(f'{json.dumps(side)}\n')
 
-            elem.clear()
-            while elem.getprevious() is not None:
-                del elem.getparent()[0]
-        del elems
+            # Full dumps
+            res = {k: v for k, v in res.items() if k in kept}
+            if p_links is not None:
+                for link in res.get('links', ()):
+                    title = link.pop('title')
+                    if title not in refs:
+                        refs[title] = len(refs)
+                    link['ref'] = refs[title]
+            with profiler.stage('json'):
+                fw_revisions.write(f'{json.dumps(rev)}\n')
+                fw_light.write(f'{json.dumps(light)}\n')
+                fw.write(f'{json.dumps(res)}\n')
+    for fw_x in fw_side.values():
+        fw_x.close()
+
+    if p_links is not None:
+        with open(p_links, 'w') as fw:
+            for title in refs:
+                fw.write(f'{json.dumps(title)}\n')
+
+    profiler.pages += num_of_articles
+    if expand_templates:
+        # The cache of the worker is kept from one block to the next
+        profiler.counts['expansion_cache_hits'] += cache.hits - hits
+        profiler.counts['expansion_cache_misses'] += cache.misses - misses
+        profiler.counts['expansion_cache_evictions'] += \
+            cache.evictions - evictions
+    profiler.bytes += (os.path.getsize(p_xml) if end == -1 else end) - beg
+    return num_of_articles, num_of_reused
 
 
 def process(beg, end, args, outpath):
+    """:return: manifest entry of the block, None if failed"""
     try:
-        fast_iter(beg, end, args.p_xml, outpath)
+        block = os.path.basename(outpath)
+        p_revisions = f'{args.outdir}/revisions/{block}'
+        outputs = [f'blocks/{block}.light.tmp', f'revisions/{block}']
+        if args.link_table:
+            p_links = f'{args.outdir}/links/{block}.tmp'
+            outputs += [f'blocks/{block}', f'links/{block}.tmp']
+        else:
+            p_links = None
+            outputs += [f'blocks/{block}.full.tmp']
+        side_outputs = {}
+        for x in args.side_outputs:
+            # Links are resolved after merging, like the ones of articles
+            side_outputs[x] = f'fields/{x}/{block}' + \
+                ('.tmp' if x == 'links' else '')
+        outputs += side_outputs.values()
+        profiler = Profiler(enabled=args.profile)
+        num_of_articles, num_of_reused = fast_iter(
+            beg, end, args.p_xml, outpath, p_revisions, p_links=p_links,
+            profiler=profiler, expand_templates=args.expand_templates,
+            fields=args.fields, lang=args.lang,
+            side_outputs={x: f'{args.outdir}/{path}'
+                          for x, path in side_outputs.items()})
+        entry = {
+            'block': block,
+            'records': num_of_articles,
+            'reused': num_of_reused,
+            'files': {x: checksum(f'{args.outdir}/{x}') for x in outputs}
+        }
+        if args.profile:
+            entry['stats'] = profiler.stats()
+        return entry
     except Exception as e:
         logger.error('unexpected error')
+        logger.error(outpath)
         logger.exception(e)
+        return None
 
 
 def load_index(pdata, index_range=None):
@@ -135,94 +311,187 @@ def load_index(pdata, index_range=None):
         res = [int(x) for x in index_range.split(':')]
         res = list(sorted(res, key=int))
     else:
-        res = set()
-        for line in bz2.BZ2File(pdata):
-            m = re.search((b'(\d+)\:\d+:.+'), line)
-            res.add(int(m.group(1)))
-        # 100 * 100 = 10,000 pages per chunk
-        res = list(sorted(res, key=int))[0::100]
-        res.append(-1)
+        # Binary cache of the index, built on the first run
+        res = DumpIndex.load(pdata).stream_offsets()
     return res
 
 
-def merge_output(outdir, verbose=True):
-    _redirect = {}
-    title2id = {}
-    disambiguation = set()
-    for i in os.listdir(f'{outdir}/blocks'):
-        if not i.endswith('.light.tmp'):
-            continue
-        with open(f'{outdir}/blocks/{i}', 'r') as f:
-            for line in f:
-                d = json.loads(line)
-                try:
-                    assert d['title'] not in title2id
-                except AssertionError:
-                    if verbose:
-                        logger.warning(f'duplicated title: {d["title"]} | '
-                                       f'{d["id"]} | {title2id[d["title"]]}')
-                    continue
-                title2id[d['title']] = d['id']
-                if d['redirect'] is not None:
-                    _redirect[d['title']] = d['redirect']
-                if d['disambiguation']:
-                    disambiguation.add(d['title'])
-
-    redirect = {}
-    for title in _redirect:
-        re_title = _redirect[title]
-        if re_title in title2id:
-            redirect[title] = re_title
-    logger.info(f'# of wicked redirect links: {len(_redirect)-len(redirect)}')
-
-    id2title = {}
-    for title in title2id:
-        if title in redirect:
-            _title = redirect[title]
-        else:
-            _title = title
-        id2title[title2id[title]] = {
-            'id': title2id[_title],
-            'title': _title
-        }
+def sort_light(inpath):
+    """Sort the light JSON dump of a block by title, into a run for
+    merge_output().
+    """
+    with open(inpath, 'r') as f:
+        records = [json.loads(line) for line in f]
+    records.sort(key=lambda d: d['title'])
+    outpath = inpath.replace('.light.tmp', '.sorted.tmp')
+    with open(outpath, 'w') as fw:
+        for d in records:
+            fw.write(f'{json.dumps(d)}\n')
+    return outpath
 
-    article = {}  # Non redirect and disambiguation pages
-    for title in title2id:
-        if title in redirect:
-            continue
-        if title in disambiguation:
-            continue
-        article[title2id[title]] = title
 
-    with open(f'{outdir}/redirect.json', 'w') as fw:
-        json.dump(redirect, fw, indent=4)
-    with open(f'{outdir}/title2id.json', 'w') as fw:
-        json.dump(title2id, fw, indent=4)
-    with open(f'{outdir}/id2title_redirected.json', 'w') as fw:
-        json.dump(id2title, fw, indent=4)
-    with open(f'{outdir}/disambiguation.json', 'w') as fw:
-        json.dump(sorted(disambiguation), fw, indent=4)
-    with open(f'{outdir}/article.json', 'w') as fw:
-        json.dump(article, fw, indent=4)
+def read_run(pdata):
+    with open(pdata, 'r') as f:
+        for line in f:
+            yield json.loads(line)
 
-    return redirect, title2id, disambiguation
 
+def merge_runs(runs, outpath):
+    """Merge sorted runs into one, the order of `runs` is kept for equal
+    titles.
+    """
+    merged = heapq.merge(*[read_run(x) for x in runs],
+                         key=lambda d: d['title'])
+    with open(outpath, 'w') as fw:
+        for d in merged:
+            fw.write(f'{json.dumps(d)}\n')
+    for i in runs:
+        os.remove(i)
+    return outpath
+
+
+class JSONWriter():
+    """Write a JSON object or array with one member per line, without
+    building it in memory.
+    """
+
+    def __init__(self, outpath, array=False):
+        self._fw = open(outpath, 'w')
+        self._end = '\n]\n' if array else '\n}\n'
+        self._fw.write('[' if array else '{')
+        self._sep = '\n'
+
+    def _write(self, s):
+        self._fw.write(f'{self._sep}{s}')
+        self._sep = ',\n'
+
+    def append(self, value):
+        self._write(json.dumps(value))
+
+    def add(self, key, value):
+        self._write(f'{json.dumps(key)}: {json.dumps(value)}')
+
+    def close(self):
+        self._fw.write(self._end)
+        self._fw.close()
+
+
+def merge_output(outdir, nworker=1, verbose=True):
+    """Build the title table from the light JSON dumps of all blocks.
+    Blocks are sorted by title in parallel, then merged as sorted runs, so
+    that titles are never held in dicts.
+    """
+    blocks = [f'{outdir}/blocks/{i}' for i in os.listdir(f'{outdir}/blocks')
+              if i.endswith('.light.tmp')]
+    pool = multiprocessing.Pool(processes=nworker)
+    runs = pool.map(sort_light, blocks)
+    # Limit the number of files opened at the same time
+    level = 0
+    while len(runs) > MERGE_FANIN:
+        groups = [runs[i:i + MERGE_FANIN]
+                  for i in range(0, len(runs), MERGE_FANIN)]
+        runs = pool.starmap(merge_runs, [
+            (group, f'{outdir}/blocks/merge_{level}_{i}.sorted.tmp')
+            for i, group in enumerate(groups)
+        ])
+        level += 1
+    pool.close()
+    pool.join()
 
-def redirect_links(pdata, outpath, redirect, title2id):
+    table = TitleTable()
+    num_of_wicked_redirect = 0
+    with tempfile.TemporaryFile('w+') as f_redirect:
+        last = None
+        merged = heapq.merge(*[read_run(x) for x in runs],
+                             key=lambda d: d['title'])
+        for d in merged:
+            if d['title'] == last:
+                if verbose:
+                    logger.warning(f'duplicated title: {d["title"]} | '
+                                   f'{d["id"]} | {table.ids[-1]}')
+                continue
+            if d['redirect'] is not None:
+                f_redirect.write(f'{json.dumps([len(table), d["redirect"]])}\n')
+            table.append(d['title'], d['id'], d['disambiguation'])
+            last = d['title']
+
+        # Redirect targets are resolved once all titles are known
+        f_redirect.seek(0)
+        for line in f_redirect:
+            rank, re_title = json.loads(line)
+            target = table.rank(re_title)
+            if target < 0:
+                num_of_wicked_redirect += 1
+                continue
+            table.redirects[rank] = target
+    logger.info(f'# of wicked redirect links: {num_of_wicked_redirect}')
+
+    fw_redirect = JSONWriter(f'{outdir}/redirect.json')
+    fw_title2id = JSONWriter(f'{outdir}/title2id.json')
+    fw_id2title = JSONWriter(f'{outdir}/id2title_redirected.json')
+    fw_disambiguation = JSONWriter(f'{outdir}/disambiguation.json', array=True)
+    fw_article = JSONWriter(f'{outdir}/article.json')
+    for rank in range(len(table)):
+        title = table.title(rank)
+        page_id = str(table.ids[rank])
+        fw_title2id.add(title, page_id)
+        if table.redirects[rank] >= 0:
+            target = table.redirects[rank]
+            re_title = table.title(target)
+            fw_redirect.add(title, re_title)
+            fw_id2title.add(page_id, {
+                'id': str(table.ids[target]),
+                'title': re_title
+            })
+            continue
+        fw_id2title.add(page_id, {'id': page_id, 'title': title})
+        if table.disambiguation[rank]:
+            fw_disambiguation.append(title)
+        else:
+            # Non redirect and disambiguation pages
+            fw_article.add(page_id, title)
+    for fw in [fw_redirect, fw_title2id, fw_id2title, fw_disambiguation,
+               fw_article]:
+        fw.close()
+
+    return table
+
+
+def redirect_links(pdata, outpath, table):
     with open(outpath, 'w') as fw:
         with open(pdata, 'r') as f:
             for line in f:
                 d = json.loads(line)
                 for link in d['links']:
-                    if link['title'] in redirect:
-                        link['title'] = redirect[link['title']]
-                    if link['title'] in title2id:
-                        link['id'] = title2id[link['title']]
-                    else:
-                        link['id'] = None
+                    link['title'], link['id'] = table.resolve(link['title'])
                 fw.write(f'{json.dumps(d)}\n')
 
 
+def resolve_link_table(pdata, outpath, table):
+    """Line n of the output is the `title` and `id` of links whose `ref` is n
+    in the articles of the block.
+    """
+    with open(outpath, 'w') as fw:
+        with open(pdata, 'r') as f:
+            for line in f:
+                title, page_id = table.resolve(json.loads(line))
+                fw.write(f'{json.dumps({"title": title, "id": page_id})}\n')
+
+
+def process_redirect(func, inpath, outpath):
+    """:return: whether :param outpath: was written"""
+    try:
+        # Moved in place once complete
+        func(inpath, f'{outpath}.part', title_table)
+        os.replace(f'{outpath}.part', outpath)
+        return True
+    except Exception as e:
+        logger.error('unexpected error')
+        logger.error(inpath)
+        logger.exception(e)
+        return False
+
+
 if __name__ == '__main__':
     parser = argparse.ArgumentParser()
     parser.add_argument('p_xml',
@@ -237,41 +506,224 @@ if __name__ == '__main__':
                         help='verbose logging')
     parser.add_argument('--index_range', '-i', default=None,
                         help='Index range for debug')
+    parser.add_argument('--chunk_size', '-c', default=10,
+                        help='compressed size (MB) of the dump processed by '
+                        'each task (default=10)')
+    parser.add_argument('--link_table', '-l', default=False,
+                        action='store_true',
+                        help='write articles once, links refer to a link '
+                        'table per block (links/) resolved after merging')
+    parser.add_argument('--resume', '-r', default=False, action='store_true',
+                        help='skip blocks completed by a previous run '
+                        '(manifest.jsonl)')
+    parser.add_argument('--retry', default=2,
+                        help='number of retries of failed blocks (default=2)')
+    parser.add_argument('--previous', '-p', default=None,
+                        help='output directory of the run of an earlier '
+                        'dump, records of unchanged pages are reused')
+    parser.add_argument('--expand_templates', '-t', default=False,
+                        action='store_true',
+                        help='expand templates instead of dropping them, '
+                        'templates of the dump are parsed once into '
+                        'p_xml.templates')
+    parser.add_argument('--fields', '-f', default=','.join(FIELDS),
+                        help='fields of articles besides '
+                        f'{", ".join(LIGHT_FIELDS)}, comma separated, '
+                        'extraction of other fields is skipped '
+                        f'(default={",".join(FIELDS)})')
+    parser.add_argument('--side_outputs', '-s', default='',
+                        help='fields also written apart, with the id and '
+                        'title of articles, to fields/{field}/, comma '
+                        'separated (e.g. links,categories)')
+    parser.add_argument('--lang', default=None,
+                        help='language code of the wiki, for the templates '
+                        'of disambiguation pages (default=from the name of '
+                        'p_xml, e.g. en for enwiki-*, English templates if '
+                        'unknown)')
+    parser.add_argument('--profile', default=False, action='store_true',
+                        help='time the stages of parsing and report '
+                        'throughput and memory usage of workers')
+    parser.add_argument('--stats', default=None,
+                        help='write profiling stats to a JSON file, implies '
+                        '--profile')
     args = parser.parse_args()
-
-    filename = os.path.split(args.p_xml)[1].replace('.xml.bz2', '')
-    # lang = re.search(r'(\w+)wiki\-', filename).group(1).replace('_', '-')
+    args.profile = args.profile or args.stats is not None
+    args.fields = [x for x in args.fields.split(',') if x]
+    args.side_outputs = [x for x in args.side_outputs.split(',') if x]
+    for x in args.fields + args.side_outputs:
+        if x not in FIELDS:
+            parser.error(f'unknown field: {x}, choose from '
+                         f'{", ".join(FIELDS)}')
+    if args.link_table and 'links' not in args.fields:
+        parser.error('--link_table requires links in --fields')
+    if args.previous and \
+       os.path.realpath(args.previous) == os.path.realpath(args.outdir):
+        parser.error('--previous must differ from outdir')
+
+    if args.lang is None:
+        args.lang = dump_lang(args.p_xml)
+    logger.info('language: %s' % args.lang)
     os.makedirs(f'{args.outdir}/blocks', exist_ok=True)
+    os.makedirs(f'{args.outdir}/revisions', exist_ok=True)
+    if args.link_table:
+        os.makedirs(f'{args.outdir}/links', exist_ok=True)
+    for x in args.side_outputs:
+        os.makedirs(f'{args.outdir}/fields/{x}', exist_ok=True)
 
     logger.info('loading index: %s' % args.p_index)
     bz2f_index = load_index(args.p_index, args.index_range)
-    logger.info('# of blocks: %s' % len(bz2f_index))
+    if args.index_range:
+        chunks = list(zip(bz2f_index, bz2f_index[1:]))
+    else:
+        chunk_size = int(float(args.chunk_size) * 1024 * 1024)
+        chunks = plan_chunks(bz2f_index, os.path.getsize(args.p_xml),
+                             chunk_size)
+    logger.info('# of blocks: %s' % len(chunks))
+
+    # Completed blocks are recorded as soon as they are done
+    manifest = Manifest(f'{args.outdir}/manifest.jsonl', resume=args.resume,
+                        plan=[f'b_{i}-{j}' for i, j in chunks])
+    logger.info('# of completed blocks: %s' % len(manifest))
+    # Blocks of a run planned otherwise would be merged along
+    num_of_stale = manifest.prune(
+        ['blocks', 'revisions', 'links'] + [f'fields/{x}' for x in FIELDS])
+    if num_of_stale:
+        logger.warning(f'# of removed files of blocks out of the plan: '
+                       f'{num_of_stale}')
+
+    if args.previous:
+        logger.info('loading revisions of the previous run: %s' %
+                    args.previous)
+        # Set before the pool is created, shared with workers through fork
+        previous = Revisions(args.previous)
+        logger.info('# of previous articles: %s' % len(previous))
+
+    if args.expand_templates:
+        logger.info('loading templates...')
+        # Set before the pool is created, the memory-mapped store is shared
+        # with workers through fork
+        use_templates(TemplateStore.load(args.p_xml,
+                                         DumpIndex.load(args.p_index),
+                                         nworker=int(args.nworker)))
+        logger.info('# of templates: %s' % len(extract.templateStore))
 
     logger.info('processing...')
-    pool = multiprocessing.Pool(processes=int(args.nworker))
     logger.info('# of workers: %s' % args.nworker)
     logger.info('parent pid: %s' % os.getpid())
-    for i, j in zip(bz2f_index, bz2f_index[1:]):
-        outpath = f'{args.outdir}/blocks/b_{i}-{j}'
-        pool.apply_async(process, args=(i, j, args, outpath,),)
-    pool.close()
-    pool.join()
+    pending = [(i, j) for i, j in chunks if f'b_{i}-{j}' not in manifest]
+    processed = [f'b_{i}-{j}' for i, j in pending]
+    # Wall time of each step of the run
+    run_times = {}
+    start = time.time()
+    for retry in range(int(args.retry) + 1):
+        if not pending:
+            break
+        if retry:
+            logger.info(f'retrying {len(pending)} failed blocks...')
+        # A worker dying (e.g. killed when out of memory) breaks the pool,
+        # its block and the ones in progress fail and are retried. Workers
+        # are forked, sharing the globals set above
+        with ProcessPoolExecutor(
+                max_workers=int(args.nworker),
+                mp_context=multiprocessing.get_context('fork')) as executor:
+            futures = []
+            for i, j in pending:
+                outpath = f'{args.outdir}/blocks/b_{i}-{j}'
+                futures.append(executor.submit(process, i, j, args, outpath))
+            num_of_broken = 0
+            for future in as_completed(futures):
+                try:
+                    manifest.add(future.result())
+                except BrokenProcessPool:
+                    num_of_broken += 1
+            if num_of_broken:
+                logger.error(f'a worker died, # of blocks not completed: '
+                             f'{num_of_broken}')
+        pending = [(i, j) for i, j in pending if f'b_{i}-{j}' not in manifest]
+    if pending:
+        logger.error(f'# of failed blocks: {len(pending)}, rerun with '
+                     '--resume to process them')
+        exit(1)
+    if args.previous:
+        logger.info('# of reused articles: %s' % sum(
+            x.get('reused', 0) for x in manifest.done.values()))
+    run_times['process'] = time.time() - start
 
     logger.info('merging...')
-    redirect, title2id, _ = merge_output(args.outdir, verbose=args.verbose)
-
-    logger.info('revising redirect links...')  # TO-DO: multi-processing
-    for i in os.listdir('%s/blocks' % args.outdir):
-        if not i.endswith('.full.tmp'):
-            continue
-        inpath = f'{args.outdir}/blocks/{i}'
-        outpath = f'{args.outdir}/blocks/{i.split(".")[0]}'
-        redirect_links(inpath, outpath, redirect, title2id)
+    start = time.time()
+    table = merge_output(args.outdir, int(args.nworker), verbose=args.verbose)
+    run_times['merge'] = time.time() - start
+
+    logger.info('revising redirect links...')
+    start = time.time()
+    # Must be a global variable set before the pool is created, workers
+    # share it through fork instead of receiving a pickled copy per task
+    title_table = table
+    pool = multiprocessing.Pool(processes=int(args.nworker))
+    if args.link_table:
+        # Only link tables are rewritten, articles are already in place
+        jobs = [(resolve_link_table, f'{args.outdir}/links', '.tmp')]
+    elif 'links' in args.fields:
+        jobs = [(redirect_links, f'{args.outdir}/blocks', '.full.tmp')]
+    else:
+        # No links to resolve, articles are moved in place
+        jobs = []
+        indir = f'{args.outdir}/blocks'
+        for i in os.listdir(indir):
+            if i.endswith('.full.tmp'):
+                os.replace(f'{indir}/{i}', f'{indir}/{i.split(".")[0]}')
+    if 'links' in args.side_outputs:
+        jobs.append((redirect_links, f'{args.outdir}/fields/links', '.tmp'))
+    tasks = []
+    for func, indir, suffix in jobs:
+        tasks += [(func, f'{indir}/{i}', f'{indir}/{i.split(".")[0]}')
+                  for i in os.listdir(indir) if i.endswith(suffix)]
+    results = []
+    for func, inpath, outpath in sorted(
+            tasks, key=lambda x: os.path.getsize(x[1]), reverse=True):
+        results.append(pool.apply_async(process_redirect,
+                                        args=(func, inpath, outpath,),))
+    pool.close()
+    pool.join()
+    num_of_failed = sum(not x.get() for x in results)
+    if num_of_failed:
+        # Inputs (*.tmp) are kept for the next run
+        logger.error(f'# of failed redirect tasks: {num_of_failed}, rerun '
+                     'with --resume to process them')
+        exit(1)
+    run_times['redirect'] = time.time() - start
 
     logger.info('cleaning...')
     cmds = [
         f'rm {args.outdir}/blocks/*.tmp',
     ]
+    if args.link_table:
+        cmds.append(f'rm {args.outdir}/links/*.tmp')
+    if 'links' in args.side_outputs:
+        cmds.append(f'rm {args.outdir}/fields/links/*.tmp')
     for cmd in cmds:
         subprocess.call(cmd, shell=True)
+
+    if args.previous:
+        logger.info('comparing with the previous run...')
+        added, removed, modified = Revisions(args.outdir).delta(previous)
+        logger.info(f'# of added: {len(added)}, removed: {len(removed)}, '
+                    f'modified: {len(modified)}')
+        with open(f'{args.outdir}/delta.json', 'w') as fw:
+            json.dump({
+                'previous': args.previous,
+                'added': added,
+                'removed': removed,
+                'modified': modified
+            }, fw, indent=4)
+
+    if args.profile:
+        # Blocks completed by an earlier run (--resume) are left out
+        summary = aggregate([manifest.done[x]['stats'] for x in processed],
+                            run_times['process'])
+        summary['run'] = run_times
+        report(summary)
+        if args.stats:
+            with open(args.stats, 'w') as fw:
+                json.dump(summary, fw, indent=4)
     logger.info('done.')
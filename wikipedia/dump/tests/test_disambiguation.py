@@ -0,0 +1,23 @@
+import os
+import sys
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), '..'))
+from common.disambiguation import Disambiguation
+
+
+def test_languages():
+    assert Disambiguation('es')('{{des}}')
+    assert not Disambiguation('en')('{{des}}')
+    assert Disambiguation('nl')('{{Dp}}')
+
+
+def test_unknown_language():
+    # English templates and the prefix and suffix rules only
+    for lang in (None, 'yo'):
+        disambiguation = Disambiguation(lang)
+        assert disambiguation('{{Dab}}')
+        assert disambiguation('{{Template:hndis|name}}')
+        assert disambiguation('{{geo disambiguation}}')
+        assert not disambiguation('{{des}}')
+        assert not disambiguation('{{dp}}')
+        assert not disambiguation('{{dab}}', redirect='Foo')
@@ -0,0 +1,153 @@
+import os
+import re
+import sys
+import random
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), '..'))
+from common import extract
+from common.extract import Extractor
+
+
+def clean_text(text):
+    extractor = Extractor('0', 0, '', 'test', [])
+    return extractor.clean_text_links(text, expand_templates=False)
+
+
+def test_links():
+    text, links = clean_text('See [[Foo|the foo]] and [http://a.org A].')
+    assert text == 'See the foo and A.'
+    assert links == [(4, 11, 'Foo', 'internal'), (16, 17, 'http://a.org',
+                                                  'external')]
+
+
+def test_markers_in_input():
+    # Markers of links, as characters or references, and the private use
+    # characters formerly used as markers, are not links
+    for markers in (extract.LINK_MARKERS, '\ue000\ue001\ue002\ue003'):
+        start, external, label, end = markers
+        fake = f'{external}http://evil{label}label{end}'
+        text, links = clean_text(
+            f'Hello {fake} world [[Foo]] {start} {label}.')
+        assert links == [(text.index('Foo'), text.index('Foo') + 3, 'Foo',
+                          'internal')]
+    text, links = clean_text(
+        'Hello &#xFDD1;http://evil&#xFDD2;label&#64979; [[Foo]].')
+    assert text == 'Hello http://evillabel Foo.'
+    assert links == [(23, 26, 'Foo', 'internal')]
+
+
+def test_placeholders():
+    pattern, placeholder = extract.placeholder_tag_patterns[0]
+
+    def in_turn(text):
+        for index, m in enumerate(pattern.finditer(text), 1):
+            text = text.replace(m.group(), '%s_%d' % (placeholder, index))
+        return text
+    for text in ['a <math>x</math> b <math>y</math> <math>x</math>.',
+                 # same text inside another element
+                 '<math>x</math> <math> <math>x</math> <math>x</math>',
+                 '<MATH>x</math><math a><math>x</math></ math>']:
+        assert extract.expandPlaceholders(
+            text, pattern, placeholder) == in_turn(text)
+
+
+def dropNestedInTurn(text, openDelim, closeDelim):
+    """dropNested() as it was before dropDiscarded(), with dropSpans()."""
+    openRE = re.compile(openDelim, re.IGNORECASE)
+    closeRE = re.compile(closeDelim, re.IGNORECASE)
+    spans = []
+    nest = 0
+    start = openRE.search(text, 0)
+    if not start:
+        return text
+    end = closeRE.search(text, start.end())
+    next = start
+    while end:
+        next = openRE.search(text, next.end())
+        if not next:
+            while nest:
+                nest -= 1
+                end0 = closeRE.search(text, end.end())
+                if end0:
+                    end = end0
+                else:
+                    break
+            spans.append((start.start(), end.end()))
+            break
+        while end.end() < next.start():
+            if nest:
+                nest -= 1
+                last = end.end()
+                end = closeRE.search(text, end.end())
+                if not end:
+                    if spans:
+                        span = (spans[0][0], last)
+                    else:
+                        span = (start.start(), last)
+                    spans = [span]
+                    break
+            else:
+                spans.append((start.start(), end.end()))
+                start = next
+                end = closeRE.search(text, next.end())
+                break
+        if next != start:
+            nest += 1
+    spans.sort()
+    res = ''
+    offset = 0
+    for s, e in spans:
+        if offset <= s:
+            if offset < s:
+                res += text[offset:s]
+            offset = e
+    res += text[offset:]
+    return res
+
+
+def dropDiscardedInTurn(text):
+    for tag in extract.discardElements:
+        text = dropNestedInTurn(text, r'<\s*%s\b[^>/]*>' % tag,
+                                r'<\s*/\s*%s>' % tag)
+    return text
+
+
+def test_drop_discarded():
+    texts = [
+        'a <ref>b</ref> c <div>d</div> e',
+        # nested elements, of the same and of other tags
+        '<div>a<div>b</div>c</div>d<ref>e<small>f</small>g</ref>h',
+        '<div>a<div>b</div>c<div>d</div>e</div>f</div>g',
+        # overlapping elements
+        '<div>a<ref>b</div>c</ref>d',
+        '<ref>a<div>b</ref>c<ref>d</div>e</ref>f',
+        '<small>a<ref>b</small>c<small>d</ref>e</small>',
+        # unbalanced tags
+        '<div>a<div>b</div>c',
+        'a</div>b<div>c',
+        '<ref>a<ref>b</ref>c<ref>d',
+        # tags made by dropping an element, or split by it
+        '<<ref>a</ref>div>b</div>c',
+        '<di<ref>a</ref>v>b</div>',
+        '<div <ref>a</ref>>b</div>',
+        '<ref <div>a</div>>b</ref>c',
+        'v><re<div></div>f> div<re<</ref>v>',
+        # attributes, spaces, case and self-closing tags
+        '<div class="a">b</ div><REF name=c>d</Ref><ref name=e/>f',
+        '< div >a</div><ſmall>b</small>',
+    ]
+    for text in texts:
+        assert extract.dropDiscarded(text) == dropDiscardedInTurn(text), text
+        assert extract.dropDiscardedInTurn(text) == \
+            dropDiscardedInTurn(text), text
+
+    pieces = ['<', '>', '/', ' ', '\n', 'x', 'div', 'ref', 'REF', 'small',
+              'ſmall', '<ref>', '</ref>', '<ref name="a">', '<ref/>',
+              '<div class="x">', '</div>', '< div >', '</ div>', '<small>',
+              '</small>', '<gallery>', '</gallery>', '<td>', '</td>', '<tr',
+              '<li>', '</li>', '<ul>', '</ul>', '<di', 'v>', '<re', 'f>']
+    rand = random.Random(0)
+    for _ in range(5000):
+        text = ''.join(rand.choice(pieces)
+                       for _ in range(rand.randint(1, 30)))
+        assert extract.dropDiscarded(text) == dropDiscardedInTurn(text), text
@@ -63,16 +63,26 @@ def filter_mention(mention):
     return True
 
 
-def count_links(pdata, expand=True, fuzzy=False):
+def count_links(pdata, expand=True, fuzzy=False, p_links=None):
+    """
+    :param p_links: link table of the block, if articles were parsed with
+      --link_table
+    """
     count = {
         'num_of_links': 0,
         'num_of_invalid_title': 0,
     }
+    link_table = []
+    if p_links:
+        with open(p_links, 'r') as f:
+            link_table = [json.loads(line) for line in f]
     res = defaultdict(lambda: defaultdict(int))
     with open(pdata, 'r') as f:
         for line in f:
             d = json.loads(line)
             for link in d['links']:
+                if 'ref' in link:
+                    link = dict(link, **link_table[link['ref']])
                 count['num_of_links'] += 1
 
                 if not link['id']:
@@ -107,9 +117,10 @@ def count_links(pdata, expand=True, fuzzy=False):
     return dict(res), count
 
 
-def process(pdata, expand=True, fuzzy=False):
+def process(pdata, expand=True, fuzzy=False, p_links=None):
     try:
-        return count_links(pdata, expand=expand, fuzzy=fuzzy)
+        return count_links(pdata, expand=expand, fuzzy=fuzzy,
+                           p_links=p_links)
     except Exception as e:
         logger.error('unexpected error')
         logger.exception(e)
@@ -169,6 +180,9 @@ if __name__ == '__main__':
                         help='threshold')
     parser.add_argument('--nworker', '-n', default=1,
                         help='Number of workers (default=1)')
+    parser.add_argument('--link_table', '-l', default=None,
+                        help='link table dir (links/), if blocks were parsed '
+                        'with --link_table')
     args = parser.parse_args()
 
     if args.p_titles:
@@ -186,6 +200,8 @@ if __name__ == '__main__':
     results = [] # TO-DO: occupied too large RAM
     for i in os.listdir(args.indir):
         _args = (f'{args.indir}/{i}', not args.no_expand_mention, args.fuzzy,)
+        if args.link_table:
+            _args += (f'{args.link_table}/{i}',)
         results.append(pool.apply_async(process, args=_args,))
     pool.close()
     pool.join()
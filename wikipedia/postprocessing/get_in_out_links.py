@@ -15,16 +15,26 @@ logging.basicConfig(format='%(asctime)s: %(levelname)s: %(message)s')
 logging.root.setLevel(level=logging.INFO)
 
 
-def get_links(pdata):
+def get_links(pdata, p_links=None):
+    """
+    :param p_links: link table of the block, if articles were parsed with
+      --link_table
+    """
     count = {
         'num_of_links': 0,
         'num_of_invalid_title': 0,
     }
+    link_table = []
+    if p_links:
+        with open(p_links, 'r') as f:
+            link_table = [json.loads(line) for line in f]
     res = defaultdict(set)
     with open(pdata, 'r') as f:
         for line in f:
             d = json.loads(line)
             for link in d['links']:
+                if 'ref' in link:
+                    link = link_table[link['ref']]
                 count['num_of_links'] += 1
                 if not link['id']:
                     count['num_of_invalid_title'] += 1
@@ -33,9 +43,9 @@ def get_links(pdata):
     return dict(res), count
 
 
-def process(pdata):
+def process(pdata, p_links=None):
     try:
-        return get_links(pdata)
+        return get_links(pdata, p_links=p_links)
     except Exception as e:
         logger.error('unexpected error')
         logger.exception(e)
@@ -55,6 +65,9 @@ if __name__ == '__main__':
     parser.add_argument('outdir', help='output dir')
     parser.add_argument('--nworker', '-n', default=1,
                         help='Number of workers (default=1)')
+    parser.add_argument('--link_table', '-l', default=None,
+                        help='link table dir (links/), if blocks were parsed '
+                        'with --link_table')
     args = parser.parse_args()
 
     logger.info('counting...')
@@ -64,7 +77,10 @@ if __name__ == '__main__':
     logger.info('processing...')
     results = [] # TO-DO: occupied too large RAM
     for i in os.listdir(args.indir):
-        _args = (f'{args.indir}/{i}',)
+        if args.link_table:
+            _args = (f'{args.indir}/{i}', f'{args.link_table}/{i}',)
+        else:
+            _args = (f'{args.indir}/{i}',)
         results.append(pool.apply_async(process, args=_args,))
     pool.close()
     pool.join()